@@ -2,10 +2,15 @@
 
 """
 
+import hashlib
+
+from collections import OrderedDict
+
 import numpy as np
+import scipy.linalg as la
+import scipy.sparse as sp
 
 from scipy.interpolate import splev
-from matplotlib import pyplot as plt
 
 
 class BSplineBasis:
@@ -39,6 +44,24 @@ class BSplineBasis:
     You can visualize a basis by calling the plot method. You may need
     to call matplotlib.pyplot.show if your backend is not interactive.
 
+    Sparse Evaluation
+    -----------------
+
+    At most degree + 1 bases are non-zero at any input. Calling a basis
+    with sparse=True returns the design matrix as a scipy.sparse CSR
+    matrix built from only those values, and the gram method computes
+    the banded matrix B'WB without forming the design matrix at all.
+
+    Repeated Evaluation
+    -------------------
+
+    When the same inputs are evaluated many times (e.g. shared visit
+    grids), call enable_cache to memoise design matrices keyed on a
+    hash of the input array. Cached matrices are returned read-only.
+    Calling with unique=True evaluates each distinct input once and
+    gathers the rows back, which pays off when inputs repeat within a
+    single call.
+
     """
 
     def __init__(self, full_knots, degree):
@@ -46,25 +69,164 @@ class BSplineBasis:
         self._degree = int(degree)
         self._dimension = len(self._knots) - self._degree - 1
         self._tck = (self._knots, np.eye(self._dimension), self._degree)
+        self._cache = None
 
     def __len__(self):
         return self._dimension
 
-    def __call__(self, x):
-        """Evaluate the bases at the given inputs."""
-        bases = np.array(splev(x, self._tck))
-        return bases.transpose()
+    def __call__(self, x, sparse=False, unique=False):
+        """Evaluate the bases at the given inputs.
+
+        Parameters
+        ----------
+        x : A sequence of inputs.
+        sparse : Return a scipy.sparse CSR matrix instead of an array.
+        unique : Evaluate each distinct input once and gather the rows.
+
+        Returns
+        -------
+        A design matrix with one row per input and one column per basis.
+
+        """
+        if self._cache is not None:
+            x = np.asarray(x, dtype=float)
+            key = (sparse, x.shape, hashlib.sha1(x.tobytes()).hexdigest())
+            bases = self._cache.get(key)
+            if bases is None:
+                bases = self._evaluate(x, sparse, unique)
+                self._cache.put(key, bases)
+            return bases
+
+        return self._evaluate(x, sparse, unique)
 
     def __repr__(self):
         knot_str = '[' + ', '.join(str(k) for k in self._knots) + ']'
         return 'BSplineBasis({}, {})'.format(knot_str, self._degree)
 
+    def enable_cache(self, max_entries=256, max_bytes=2**28):
+        """Memoise evaluated design matrices in a bounded LRU cache.
+
+        Parameters
+        ----------
+        max_entries : The largest number of cached design matrices.
+        max_bytes : The largest total size of the cached matrices.
+
+        """
+        self._cache = _ArrayCache(max_entries, max_bytes)
+
+    def disable_cache(self):
+        """Drop the cache and stop memoising design matrices."""
+        self._cache = None
+
+    def cache_info(self):
+        """Statistics of the cache (None if caching is disabled)."""
+        return None if self._cache is None else self._cache.info()
+
+    def _evaluate(self, x, sparse, unique):
+        """Evaluate the bases, optionally only at the distinct inputs."""
+        if unique:
+            x = np.asarray(x, dtype=float)
+            distinct, inverse = np.unique(x.ravel(), return_inverse=True)
+            return self._evaluate(distinct, sparse, False)[inverse]
+
+        if sparse:
+            first, values = self._local_bases(x)
+            num_rows, num_local = values.shape
+            columns = first[:, None] + np.arange(num_local)
+            indptr = np.arange(0, num_rows * num_local + 1, num_local)
+            return sp.csr_matrix((values.ravel(), columns.ravel(), indptr),
+                                 shape=(num_rows, self._dimension))
+
+        bases = np.array(splev(x, self._tck))
+        return bases.transpose()
+
+    def gram(self, x, weights=None, banded=False):
+        """Compute the weighted Gram matrix B'WB of the design matrix.
+
+        Parameters
+        ----------
+        x : A sequence of inputs.
+        weights : A weight for each input (default: all ones).
+        banded : Return the upper band of the matrix in the layout used
+            by scipy.linalg.solveh_banded and cholesky_banded.
+
+        Returns
+        -------
+        The Gram matrix as a scipy.sparse CSR matrix, or its upper band
+        as an array of shape (degree + 1, len(self)).
+
+        """
+        first, values = self._local_bases(x)
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float).ravel()
+
+        k, dim = self._degree, self._dimension
+        band = np.zeros((k + 1, dim))
+
+        for a in range(k + 1):
+            for b in range(a, k + 1):
+                products = values[:, a] * values[:, b]
+                if weights is not None:
+                    products *= weights
+                band[k - (b - a)] += np.bincount(first + b, products, dim)
+
+        if banded:
+            return band
+
+        offsets = np.arange(-k, k + 1)
+        diagonals = [band[k - abs(o), abs(o):] for o in offsets]
+        return sp.diags(diagonals, offsets, format='csr')
+
     def plot(self, grid_size=200):
-        """Plot the individual bases in the basis."""
+        """Plot the individual bases in the basis.
+
+        matplotlib is imported here rather than with the module so that
+        headless users of the basis never load it.
+
+        """
+        from matplotlib import pyplot as plt
+
         xgrid = np.linspace(self._knots[0], self._knots[-1], grid_size)
         for ygrid in self(xgrid).T:
             plt.plot(xgrid, ygrid)
 
+    def _local_bases(self, x):
+        """Evaluate the non-zero bases at each input.
+
+        The values are computed by the Cox-de Boor recursion on the knot
+        span of each input (Piegl and Tiller, The NURBS Book, A2.2),
+        vectorised over the inputs. Inputs outside the boundary knots
+        extrapolate the end polynomial pieces, as splev does.
+
+        Returns
+        -------
+        The index of the first non-zero basis of each input and an
+        array of shape (len(x), degree + 1) of the non-zero values.
+
+        """
+        t, k = self._knots, self._degree
+        x = np.atleast_1d(np.asarray(x, dtype=float)).ravel()
+
+        span = np.searchsorted(t, x, side='right') - 1
+        span = np.clip(span, k, self._dimension - 1)
+
+        values = np.zeros((len(x), k + 1))
+        values[:, 0] = 1.0
+        left = np.zeros((len(x), k + 1))
+        right = np.zeros((len(x), k + 1))
+
+        for j in range(1, k + 1):
+            left[:, j] = x - t[span + 1 - j]
+            right[:, j] = t[span + j] - x
+            saved = 0.0
+            for r in range(j):
+                temp = values[:, r] / (right[:, r + 1] + left[:, j - r])
+                values[:, r] = saved + right[:, r + 1] * temp
+                saved = left[:, j - r] * temp
+            values[:, j] = saved
+
+        return span - k, values
+
     @classmethod
     def uniform(cls, low, high, num_bases, degree):
         '''Construct a uniform basis between low and high.
@@ -109,6 +271,416 @@ class BSplineBasis:
         return cls(knots, degree)
 
 
+class TensorProductBasis:
+    """A tensor-product B-spline basis over a multi-dimensional domain.
+
+    The bases are the products of one basis from each of several
+    marginal BSplineBasis instances, so a basis built from marginals
+    of dimensions K1, ..., Kd has K1 * ... * Kd bases. The coefficient
+    of the product of bases (i1, ..., id) is at the position of that
+    index in a C-ordered array of shape (K1, ..., Kd).
+
+    Scattered Data
+    --------------
+
+    Calling the basis with a sequence holding one array of coordinates
+    per dimension returns the row-wise Kronecker product of the
+    marginal design matrices. Each row has only (degree + 1)**d
+    non-zero values, so the design matrix is best built with
+    sparse=True:
+
+    >>> basis = TensorProductBasis(BSplineBasis.uniform(0, 1, 20, 3),
+    ...                            BSplineBasis.uniform(0, 5, 30, 3))
+    >>> B = basis([age, time], sparse=True)
+
+    Gridded Data
+    ------------
+
+    When the data lie on the Cartesian product of one grid per
+    dimension the design matrix is the Kronecker product of the
+    marginal design matrices. The grid_* methods compute products with
+    it by contracting each marginal design matrix with one axis of an
+    array (Currie, Durban and Eilers, Generalized linear array models
+    with applications to multidimensional smoothing, 2006), so the full
+    design matrix is never formed.
+
+    """
+
+    def __init__(self, *bases):
+        self._bases = tuple(bases)
+        self._shape = tuple(len(b) for b in self._bases)
+
+    def __len__(self):
+        return int(np.prod(self._shape))
+
+    def __call__(self, x, sparse=False):
+        """Evaluate the bases at the given inputs.
+
+        Parameters
+        ----------
+        x : A sequence with one array of coordinates per dimension.
+        sparse : Return a scipy.sparse CSR matrix instead of an array.
+
+        Returns
+        -------
+        A design matrix with one row per input and one column per basis.
+
+        """
+        first, values = self._local_bases(x)
+        num_rows, num_local = values.shape
+        indptr = np.arange(0, num_rows * num_local + 1, num_local)
+        bases = sp.csr_matrix((values.ravel(), first.ravel(), indptr),
+                              shape=(num_rows, len(self)))
+        return bases if sparse else bases.toarray()
+
+    def __repr__(self):
+        return 'TensorProductBasis({})'.format(
+            ', '.join(repr(b) for b in self._bases))
+
+    @property
+    def bases(self):
+        """The marginal bases."""
+        return self._bases
+
+    @property
+    def shape(self):
+        """The dimensions of the marginal bases."""
+        return self._shape
+
+    def gram(self, x, weights=None):
+        """Compute the weighted Gram matrix B'WB of the design matrix.
+
+        Parameters
+        ----------
+        x : A sequence with one array of coordinates per dimension.
+        weights : A weight for each input (default: all ones).
+
+        Returns
+        -------
+        The Gram matrix as a scipy.sparse CSR matrix.
+
+        """
+        B = self(x, sparse=True)
+        if weights is None:
+            return (B.T @ B).tocsr()
+        return (B.T @ sp.diags(np.asarray(weights, dtype=float)) @ B).tocsr()
+
+    def grid_dot(self, grids, coef):
+        """Evaluate a tensor-product spline on a grid.
+
+        Parameters
+        ----------
+        grids : A sequence with one array of grid points per dimension.
+        coef : The coefficients of the spline.
+
+        Returns
+        -------
+        An array of shape (len(grids[0]), ..., len(grids[-1])) of the
+        values of the spline at each point of the grid.
+
+        """
+        values = np.reshape(coef, self._shape)
+        for basis, grid in zip(self._bases, grids):
+            values = _rotated_product(basis(grid), values)
+        return values
+
+    def grid_dot_transpose(self, grids, values):
+        """Multiply gridded values by the transposed design matrix.
+
+        Parameters
+        ----------
+        grids : A sequence with one array of grid points per dimension.
+        values : An array with one value per point of the grid.
+
+        Returns
+        -------
+        The vector B'y of length len(self).
+
+        """
+        for basis, grid in zip(self._bases, grids):
+            values = _rotated_product(basis(grid).T, values)
+        return values.ravel()
+
+    def grid_gram(self, grids, weights=None):
+        """Compute the weighted Gram matrix B'WB of gridded data.
+
+        Parameters
+        ----------
+        grids : A sequence with one array of grid points per dimension.
+        weights : An array with one weight per point of the grid
+            (default: all ones).
+
+        Returns
+        -------
+        The Gram matrix as an array of shape (len(self), len(self)).
+
+        """
+        shape = tuple(len(g) for g in grids)
+        if weights is None:
+            weights = np.ones(shape)
+
+        gram = np.asarray(weights, dtype=float)
+        for basis, grid in zip(self._bases, grids):
+            B = basis(grid)
+            rows = (B[:, :, None] * B[:, None, :]).reshape(len(B), -1)
+            gram = _rotated_product(rows.T, gram)
+
+        d = len(self._shape)
+        gram = gram.reshape([k for k in self._shape for _ in range(2)])
+        gram = gram.transpose(list(range(0, 2 * d, 2)) +
+                              list(range(1, 2 * d, 2)))
+        return gram.reshape(len(self), len(self))
+
+    def penalties(self, order=1):
+        """Return the difference penalty of each dimension.
+
+        The penalty of dimension j is the Kronecker product of the
+        difference penalty of the j-th marginal basis with identity
+        matrices of the other dimensions, so it penalises changes in
+        the coefficients along that dimension only.
+
+        Parameters
+        ----------
+        order : The order of the differences, either one for all
+            dimensions or a sequence with one order per dimension.
+
+        Returns
+        -------
+        A list with one sparse (CSR) penalty matrix per dimension.
+
+        """
+        penalties = []
+        orders = self._orders(order)
+        for j, (basis, o) in enumerate(zip(self._bases, orders)):
+            P = sp.identity(1, format='csr')
+            for i, k in enumerate(self._shape):
+                if i == j:
+                    marginal = sp.csr_matrix(pspline_penalty(basis, o))
+                else:
+                    marginal = sp.identity(k, format='csr')
+                P = sp.kron(P, marginal, format='csr')
+            penalties.append(P)
+        return penalties
+
+    def _orders(self, order):
+        """One difference order per dimension."""
+        return tuple(np.broadcast_to(order, len(self._bases)).tolist())
+
+    def _local_bases(self, x):
+        """Evaluate the non-zero bases at each input.
+
+        Returns
+        -------
+        The column indices and the values of the non-zero bases of each
+        input, both arrays of shape (len(x[0]), num_non_zero).
+
+        """
+        columns = np.zeros(1, dtype=int)
+        values = np.ones(1)
+        for basis, xj, k in zip(self._bases, x, self._shape):
+            first, local = basis._local_bases(xj)
+            offsets = first[:, None] + np.arange(local.shape[1])
+            shape = ((len(local),) + (1,) * (columns.ndim - 1) +
+                     (local.shape[1],))
+            columns = columns[..., None] * k + offsets.reshape(shape)
+            values = values[..., None] * local.reshape(shape)
+
+        return (columns.reshape(len(columns), -1),
+                values.reshape(len(values), -1))
+
+
+class PSpline:
+    """A penalized B-spline regression (P-spline) estimator.
+
+    The coefficients minimise the weighted residual sum of squares plus
+    lam times the difference penalty of pspline_penalty. The penalty
+    weight is chosen from a path of candidates by generalized cross
+    validation (GCV) or restricted maximum likelihood (REML).
+
+    The whole path is cheap: one generalized eigendecomposition
+    G U = (G + cP) U diag(mu) of the Gram matrix G = B'WB against the
+    positive definite G + cP, with c = trace(G) / trace(P), diagonalises
+    G + lam P as diag(mu + lam (1 - mu) / c) for every lam, even when G
+    is singular. The effective degrees of freedom, the residual sum of
+    squares and both criteria then cost O(K) per candidate. The final
+    coefficients solve the banded system (G + lam P) theta = B'Wy by
+    banded Cholesky factorisation.
+
+    >>> spline = PSpline(BSplineBasis.uniform(0, 1, 200, 3)).fit(x, y)
+    >>> yhat = spline(xgrid)
+
+    The basis may also be a TensorProductBasis, with the sum of its
+    per-dimension penalties. Surfaces observed on a grid are fit with
+    grid=True, which never forms the design matrix:
+
+    >>> spline = PSpline(basis).fit([ages, times], Y, grid=True)
+    >>> Yhat = spline([ages, times], grid=True)
+
+    """
+
+    def __init__(self, basis, order=2):
+        self._basis = basis
+        self._order = order
+        self._coef = None
+        self._lam = None
+        self._path = None
+
+    @property
+    def coef(self):
+        """The fitted spline coefficients."""
+        return np.array(self._coef)
+
+    @property
+    def lam(self):
+        """The selected penalty weight."""
+        return self._lam
+
+    @property
+    def path(self):
+        """The candidate penalty weights with their 'edf', 'gcv' and 'reml'."""
+        return dict(self._path)
+
+    def __call__(self, x, grid=False):
+        """Evaluate the fitted spline at the given inputs.
+
+        With grid=True, x holds one array of grid points per dimension
+        of a TensorProductBasis and the spline is evaluated at every
+        point of the grid.
+
+        """
+        if grid:
+            return self._basis.grid_dot(x, self._coef)
+        return self._basis(x, sparse=True) @ self._coef
+
+    def fit(self, x, y, weights=None, lambdas=None, criterion='gcv',
+            grid=False):
+        """Fit the spline, choosing the penalty weight from a path.
+
+        Parameters
+        ----------
+        x : Locations of observed measurements.
+        y : Values of observed measurements.
+        weights : A weight for each measurement (default: all ones).
+        lambdas : Candidate penalty weights (default: 50 values spread
+            log-uniformly over 12 orders of magnitude around
+            trace(B'WB) / trace(P)).
+        criterion : Either 'gcv' or 'reml'.
+        grid : If true, x holds one array of grid points per dimension
+            of a TensorProductBasis, and y and weights are arrays with
+            one element per point of the grid.
+
+        Returns
+        -------
+        The fit spline.
+
+        """
+        y = np.asarray(y, dtype=float)
+        wy = y if weights is None else np.asarray(weights) * y
+        n, m0 = y.size, _penalty_null_dim(self._basis, self._order)
+
+        if grid:
+            G = self._basis.grid_gram(x, weights)
+            rhs = self._basis.grid_dot_transpose(x, wy)
+        else:
+            G = self._basis.gram(x, weights).toarray()
+            rhs = self._basis(x, sparse=True).T @ wy
+
+        y, wy = y.ravel(), wy.ravel()
+        penalty = pspline_penalty(self._basis, self._order)
+        if sp.issparse(penalty):
+            penalty = penalty.toarray()
+        scale = np.trace(G) / np.trace(penalty)
+        if lambdas is None:
+            lambdas = scale * np.logspace(-6, 6, 50)
+        lambdas = np.asarray(lambdas, dtype=float)
+
+        mu, U = la.eigh(G, G + scale * penalty)
+        mu = np.clip(mu, 0.0, 1.0)
+        z2 = (U.T @ rhs)**2
+
+        diag = mu[None, :] + lambdas[:, None] * (1 - mu[None, :]) / scale
+        edf = (mu / diag).sum(axis=1)
+        fit = (z2 / diag).sum(axis=1)
+        rss = wy @ y - 2 * fit + (mu * z2 / diag**2).sum(axis=1)
+        gcv = n * rss / (n - edf)**2
+        penalized = np.maximum(wy @ y - fit, np.finfo(float).tiny)
+        reml = ((n - m0) * np.log(penalized) + np.log(diag).sum(axis=1)
+                - (len(mu) - m0) * np.log(lambdas))
+
+        scores = {'gcv': gcv, 'reml': reml}[criterion]
+        best = int(np.argmin(scores))
+        self._lam = lambdas[best]
+        self._path = {'lambdas': lambdas, 'edf': edf, 'gcv': gcv,
+                      'reml': reml}
+
+        system = G + self._lam * penalty
+        system = _upper_band(system, _bandwidth(system))
+        factor = la.cholesky_banded(system)
+        self._coef = la.cho_solve_banded((factor, False), rhs)
+
+        return self
+
+    def effective_dof(self):
+        """The effective degrees of freedom of the fitted spline."""
+        best = np.flatnonzero(self._path['lambdas'] == self._lam)[0]
+        return self._path['edf'][best]
+
+
+class _ArrayCache:
+    """A least recently used cache of arrays bounded in count and size."""
+
+    def __init__(self, max_entries, max_bytes):
+        self._entries = OrderedDict()
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key):
+        """Look up an array, marking it as recently used."""
+        if key not in self._entries:
+            self._misses += 1
+            return None
+
+        self._hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, value):
+        """Store an array, evicting the least recently used ones."""
+        size = _num_bytes(value)
+        if size > self._max_bytes:
+            return
+
+        if sp.issparse(value):
+            arrays = [value.data, value.indices, value.indptr]
+        else:
+            arrays = [value]
+        for array in arrays:
+            array.flags.writeable = False
+
+        self._entries[key] = value
+        self._bytes += size
+
+        while (len(self._entries) > self._max_entries or
+               self._bytes > self._max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= _num_bytes(evicted)
+
+    def info(self):
+        """The number of hits, misses, entries and bytes in the cache."""
+        return {'hits': self._hits, 'misses': self._misses,
+                'entries': len(self._entries), 'bytes': self._bytes}
+
+
+def _num_bytes(value):
+    """The memory used by a dense or sparse matrix."""
+    if sp.issparse(value):
+        return value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+    return value.nbytes
+
+
 def pspline_penalty(basis, order=1):
     '''Return a differences penalty matrix.
 
@@ -117,6 +689,47 @@ def pspline_penalty(basis, order=1):
     coefficient values are penalized. Higher order difference matrices
     effectively decrease the degrees of freedom of the regression.
 
+    For a TensorProductBasis the penalty is the sparse sum of the
+    penalties of each dimension (see TensorProductBasis.penalties), and
+    order may be a sequence with one order per dimension.
+
     '''
+    if isinstance(basis, TensorProductBasis):
+        penalties = basis.penalties(order)
+        return sum(penalties[1:], penalties[0]).tocsr()
+
     D = np.diff(np.eye(len(basis)), order)
     return D @ D.T
+
+
+def _upper_band(A, bandwidth):
+    """The upper band of a symmetric matrix in LAPACK band storage."""
+    n = len(A)
+    band = np.zeros((bandwidth + 1, n))
+    for offset in range(bandwidth + 1):
+        band[bandwidth - offset, offset:] = np.diagonal(A, offset)
+    return band
+
+
+def _penalty_null_dim(basis, order):
+    """The dimension of the null space of a difference penalty."""
+    if isinstance(basis, TensorProductBasis):
+        return int(np.prod(basis._orders(order)))
+    return order
+
+
+def _bandwidth(A):
+    """The number of non-zero superdiagonals of a symmetric matrix."""
+    rows, columns = np.nonzero(np.triu(A))
+    return int(np.max(columns - rows, initial=0))
+
+
+def _rotated_product(A, X):
+    """Multiply the first axis of an array by a matrix and rotate it last.
+
+    Applying this once per axis with a matrix for each axis computes
+    the product of the Kronecker product of the matrices with the
+    flattened array, and leaves the axes in their original order.
+
+    """
+    return np.moveaxis(np.tensordot(A, X, axes=(1, 0)), 0, -1)
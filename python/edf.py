@@ -5,11 +5,15 @@ For information on the spec see:
 http://www.edfplus.info/
 
 """
+import os
+
 from collections import OrderedDict, namedtuple
 
 import numpy as np
 
-__all__ = ['header_and_signals', 'samples_per_sec']
+__all__ = ['header_and_signals', 'header_and_lazy_signals', 'samples_per_sec',
+           'read_records', 'read_seconds', 'iter_records', 'iter_epochs',
+           'SignalView']
 
 
 _RAW_INT_FORMAT = '<i2'
@@ -25,12 +29,13 @@ StartTime = namedtuple('StartTime', ['hour', 'minute', 'second'])
 """Data structure for the start time field."""
 
 
-def header_and_signals(edf_file):
+def header_and_signals(edf_file, channels=None):
     """Extract the header and signals from an EDF file.
 
     Parameters
     ----------
     edf_file : A file object opened to read bytes.
+    channels : Labels or indices of the signals to read (default: all).
 
     Returns
     -------
@@ -42,17 +47,276 @@ def header_and_signals(edf_file):
     assert edf_file.tell() == 0
 
     header = _read_header(edf_file)
-    signals = _read_signals(edf_file, header)
+    signals = _read_signals(edf_file, header, channels)
 
     return header, signals
 
 
+def header_and_lazy_signals(edf_file, channels=None):
+    """Extract the header and lazy views of the signals from an EDF file.
+
+    Only the header is parsed; the data section is memory-mapped and
+    samples are read and converted to physical units when a view is
+    indexed. The views remain valid as long as the file exists.
+
+    Parameters
+    ----------
+    edf_file : A file object opened to read bytes.
+    channels : Labels or indices of the signals to read (default: all).
+
+    Returns
+    -------
+    A 2-tuple containing a dictionary of header fields and a
+    dictionary of SignalView objects.
+
+    """
+    assert 'b' in edf_file.mode
+    assert edf_file.tell() == 0
+
+    header = _read_header(edf_file)
+    records = _map_records(edf_file, header)
+
+    signals = OrderedDict()
+    for channel in _channel_indices(header, channels):
+        label = header['label'][channel]
+        signals[label] = SignalView(records, channel, header)
+
+    return header, signals
+
+
+def read_records(edf_file, header, start=0, stop=None, channels=None):
+    """Read a contiguous range of records from an EDF file.
+
+    Parameters
+    ----------
+    edf_file : An open file object from which a header has been read.
+    header : The header dictionary read from the file object.
+    start : Index of the first record to read.
+    stop : Index one past the last record to read (default: the end).
+    channels : Labels or indices of the signals to read (default: all).
+
+    Returns
+    -------
+    A dictionary containing the signals in the range of records.
+
+    """
+    labels = [header['label'][c] for c in _channel_indices(header, channels)]
+    signals = OrderedDict([(label, []) for label in labels])
+
+    for record in iter_records(edf_file, header, start, stop, channels):
+        for label, signal in record.items():
+            signals[label].append(signal)
+
+    for label, signal in signals.items():
+        signals[label] = np.concatenate(signal) if signal else np.empty(0)
+
+    return signals
+
+
+def read_seconds(edf_file, header, start, stop, channels=None):
+    """Read the samples recorded in a time window from an EDF file.
+
+    Only the records overlapping the window are read. Each signal is
+    trimmed to the samples whose time offset t (in seconds from the
+    start of the recording) satisfies start <= t < stop.
+
+    Parameters
+    ----------
+    edf_file : An open file object from which a header has been read.
+    header : The header dictionary read from the file object.
+    start : Start of the window in seconds (earlier times are clipped
+        to the start of the recording).
+    stop : End of the window in seconds.
+    channels : Labels or indices of the signals to read (default: all).
+
+    Returns
+    -------
+    A dictionary containing the signals in the time window.
+
+    """
+    start = max(start, 0)
+    seconds = header['seconds_per_record']
+    first = int(start // seconds)
+    last = int(-(-stop // seconds))
+    signals = read_records(edf_file, header, first, last, channels)
+
+    rates = samples_per_sec(header)
+    for label, signal in signals.items():
+        offset = _sample_index(first * seconds, rates[label])
+        lo = _sample_index(start, rates[label]) - offset
+        hi = _sample_index(stop, rates[label]) - offset
+        signals[label] = signal[max(lo, 0):max(hi, 0)]
+
+    return signals
+
+
+def iter_records(edf_file, header, start=0, stop=None, channels=None):
+    """Yield the records of an EDF file one at a time.
+
+    Parameters
+    ----------
+    edf_file : An open file object from which a header has been read.
+    header : The header dictionary read from the file object.
+    start : Index of the first record to read.
+    stop : Index one past the last record to read (default: the end).
+    channels : Labels or indices of the signals to read (default: all).
+
+    Yields
+    ------
+    A dictionary containing the signals in each record.
+
+    """
+    start, stop = _record_range(edf_file, header, start, stop)
+    channels = _channel_indices(header, channels)
+    _seek_record(edf_file, header, start)
+
+    for _ in range(start, stop):
+        yield _read_record(edf_file, header, channels)
+
+
+def iter_epochs(edf_file, header, epoch_seconds, start=0, stop=None,
+                channels=None):
+    """Yield fixed-length epochs of an EDF file one at a time.
+
+    Epochs need not align with records; at most one record beyond the
+    current epoch is held in memory. A trailing partial epoch is not
+    yielded.
+
+    Parameters
+    ----------
+    edf_file : An open file object from which a header has been read.
+    header : The header dictionary read from the file object.
+    epoch_seconds : The length of each epoch in seconds.
+    start : Start of the first epoch in seconds (earlier times are
+        clipped to the start of the recording).
+    stop : Time in seconds after which no epoch may end (default: the
+        end; later times are clipped to the end).
+    channels : Labels or indices of the signals to read (default: all).
+
+    Yields
+    ------
+    A dictionary containing the signals in each epoch.
+
+    """
+    channels = _channel_indices(header, channels)
+    rates = samples_per_sec(header)
+    rates = OrderedDict([(header['label'][c], rates[header['label'][c]])
+                         for c in channels])
+
+    epoch_samples = OrderedDict()
+    for label, rate in rates.items():
+        num_samples = rate * epoch_seconds
+        if num_samples != int(num_samples):
+            msg = 'Epoch length does not divide the samples of {}.'
+            raise ValueError(msg.format(label))
+        epoch_samples[label] = int(num_samples)
+
+    start = max(start, 0)
+    seconds = header['seconds_per_record']
+    first = int(start // seconds)
+    duration = _num_records(edf_file, header) * seconds
+    stop = duration if stop is None else min(stop, duration)
+    num_epochs = max(int((stop - start) // epoch_seconds), 0)
+
+    buffers = OrderedDict()
+    for label, rate in rates.items():
+        skip = (_sample_index(start, rate) -
+                _sample_index(first * seconds, rate))
+        buffers[label] = (skip, [])
+
+    records = iter_records(edf_file, header, first, channels=channels)
+
+    for _ in range(num_epochs):
+        epoch = OrderedDict()
+
+        for label, num_samples in epoch_samples.items():
+            skip, chunks = buffers[label]
+            while sum(len(c) for c in chunks) - skip < num_samples:
+                for chunk_label, signal in next(records).items():
+                    buffers[chunk_label][1].append(signal)
+
+            buffered = np.concatenate(chunks)[skip:]
+            epoch[label] = buffered[:num_samples]
+            buffers[label] = (0, [buffered[num_samples:]])
+
+        yield epoch
+
+
 def samples_per_sec(header):
     """Number of samples per second for each signal."""
     hertz = header['samples_per_record'] / header['seconds_per_record']
     return OrderedDict(zip(header['label'], hertz))
 
 
+class SignalView:
+    """A lazy, read-only view of one signal in a memory-mapped EDF file.
+
+    The view behaves like a 1D array of physical values. Indexing it
+    with an integer, a slice, or an array of indices reads only the
+    records holding the requested samples of this signal. Use
+    numpy.asarray to materialise the full signal.
+
+    """
+
+    def __init__(self, records, channel, header):
+        start = _record_offsets(header)[channel]
+        stop = start + header['samples_per_record'][channel]
+        self._digital = records[:, start:stop]
+        self._channel = channel
+        self._header = header
+
+    def __len__(self):
+        return self._digital.size
+
+    def __getitem__(self, key):
+        digital = np.asarray(self.digital(key), dtype=float)
+        return _dig_to_phys(digital, self._channel, self._header)
+
+    def __array__(self, dtype=None, copy=None):
+        signal = self[:]
+        return signal if dtype is None else signal.astype(dtype)
+
+    def __repr__(self):
+        label = self._header['label'][self._channel]
+        return 'SignalView({!r}, length={})'.format(label, len(self))
+
+    @property
+    def shape(self):
+        """The shape of the full signal."""
+        return (len(self),)
+
+    @property
+    def samples_per_record(self):
+        """The number of samples of this signal in each record."""
+        return self._digital.shape[1]
+
+    def digital(self, key=slice(None)):
+        """Read the raw digital samples selected by key."""
+        n = self.samples_per_record
+
+        if isinstance(key, slice):
+            span = range(len(self))[key]
+            if not span:
+                return np.empty(0, _RAW_INT_FORMAT)
+            lo, hi = min(span[0], span[-1]), max(span[0], span[-1])
+            first, last = lo // n, hi // n + 1
+            block = self._digital[first:last].reshape(-1)
+            return block[span[0] - first * n::span.step][:len(span)]
+
+        if np.ndim(key) == 0:
+            index = range(len(self))[key]
+            return self._digital[index // n, index % n]
+
+        index = np.asarray(key)
+        if index.dtype == bool:
+            index = np.flatnonzero(index)
+        index = np.where(index < 0, index + len(self), index)
+        if np.any((index < 0) | (index >= len(self))):
+            raise IndexError('Sample index out of range.')
+
+        return self._digital[index // n, index % n]
+
+
 def _read_header(edf_file):
     """Extract the contents of the EDF header as a dictionary.
 
@@ -107,65 +371,140 @@ def _read_header(edf_file):
     return header
 
 
-def _read_signals(edf_file, header):
+def _read_signals(edf_file, header, channels=None):
     """Read all signals from the file.
 
     Parameters
     ----------
     edf_file : An open file object from which a header has been read.
     header : The header dictionary read from the file object.
+    channels : Labels or indices of the signals to read (default: all).
 
     Returns
     -------
     A dictionary containing the full signals.
 
     """
-    signals = OrderedDict([(label, []) for label in header['label']])
-
-    while True:
-        try:
-            record = _read_record(edf_file, header)
-        except EOFError:
-            break
-
-        for label, signal in record.items():
-            signals[label].append(signal)
-
-    for label, signal in signals.items():
-        signals[label] = np.concatenate(signal)
-
-    return signals
+    return read_records(edf_file, header, channels=channels)
 
 
-def _read_record(edf_file, header):
+def _read_record(edf_file, header, channels=None):
     """Read a single record from the EDF file.
 
+    Unselected channels are skipped by seeking past their bytes, so
+    they are neither read nor converted. The file object is left at
+    the start of the next record.
+
     Parameters
     ----------
-    edf_file : An open file object from which a header has been read.
+    edf_file : An open file object positioned at the start of a record.
     header : The header dictionary read from the file object.
+    channels : Labels or indices of the signals to read (default: all).
 
     Returns
     -------
-    A list containing the signals in the record as arrays.
+    A dictionary containing the signals in the record as arrays.
 
     """
     labels = header['label']
+    offsets = _record_offsets(header) * _RAW_INT_SIZE
+    record_start = edf_file.tell()
     signals = OrderedDict()
 
-    for channel in range(header['num_signals']):
+    for channel in _channel_indices(header, channels):
         num_bytes = _bytes_per_record(channel, header)
+        edf_file.seek(record_start + offsets[channel])
         raw_bytes = edf_file.read(num_bytes)
         if not len(raw_bytes) == num_bytes:
             raise EOFError('Could not read a full record.')
 
-        digital = np.fromstring(raw_bytes, _RAW_INT_FORMAT).astype(np.float)
+        digital = np.frombuffer(raw_bytes, _RAW_INT_FORMAT).astype(float)
         physical = _dig_to_phys(digital, channel, header)
         signals[labels[channel]] = physical
 
+    edf_file.seek(record_start + _record_bytes(header))
+
     return signals
 
 
+def _map_records(edf_file, header):
+    """Memory-map the data section as a (records x samples) array."""
+    num_records = _num_records(edf_file, header)
+    record_size = int(header['samples_per_record'].sum())
+
+    if num_records == 0:
+        return np.empty((0, record_size), _RAW_INT_FORMAT)
+
+    return np.memmap(edf_file, _RAW_INT_FORMAT, mode='r',
+                     offset=header['num_header_bytes'],
+                     shape=(num_records, record_size))
+
+
+def _num_records(edf_file, header):
+    """The number of complete records stored in the file."""
+    file_size = os.fstat(edf_file.fileno()).st_size
+    data_size = file_size - header['num_header_bytes']
+    num_records = max(data_size, 0) // _record_bytes(header)
+
+    if header['num_records'] >= 0:
+        num_records = min(num_records, header['num_records'])
+
+    return num_records
+
+
+def _file_stamp(filename):
+    """The size and modification time of a file."""
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _record_offsets(header):
+    """The offset of each channel (in samples) within a record."""
+    samples = header['samples_per_record']
+    return np.concatenate([[0], np.cumsum(samples)[:-1]]).astype(int)
+
+
+def _channel_indices(header, channels):
+    """Resolve a selection of channels by label or index to indices."""
+    num_signals = header['num_signals']
+    if channels is None:
+        return list(range(num_signals))
+
+    indices = []
+    for channel in channels:
+        if isinstance(channel, str):
+            if channel not in header['label']:
+                raise ValueError('Unknown channel {!r}.'.format(channel))
+            channel = header['label'].index(channel)
+        indices.append(range(num_signals)[channel])
+
+    return indices
+
+
+def _record_range(edf_file, header, start, stop):
+    """Clip a range of record indices to the records in the file."""
+    num_records = _num_records(edf_file, header)
+    stop = num_records if stop is None else min(stop, num_records)
+    start = min(max(start, 0), stop)
+    return start, stop
+
+
+def _seek_record(edf_file, header, record):
+    """Position the file object at the start of a record."""
+    offset = header['num_header_bytes'] + record * _record_bytes(header)
+    edf_file.seek(offset)
+
+
+def _sample_index(seconds, rate):
+    """The index of the first sample at or after a time offset."""
+    return int(np.ceil(round(seconds * rate, 6)))
+
+
+def _record_bytes(header):
+    """The number of bytes in a full record of all channels."""
+    return int(header['samples_per_record'].sum()) * _RAW_INT_SIZE
+
+
 def _bytes_per_record(channel, header):
     """The number of bytes from this channel per record."""
     num_samples = header['samples_per_record'][channel]
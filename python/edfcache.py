@@ -0,0 +1,323 @@
+"""A columnar on-disk cache of EDF recordings.
+
+Each recording is converted once into a directory holding one
+contiguous .npy file of physical values per signal and the header as
+JSON. Later loads memory-map the .npy files, so opening a cached
+recording costs a JSON parse and reading a signal touches only its
+own file. A manifest in the cache directory summarises every cached
+recording and can be queried without opening any EDF file:
+
+>>> ingest('recordings/', 'cache/', processes=8)
+>>> for entry in query('cache/', label='EEG Fpz-Cz', rate=100):
+...     header, signals = load('cache/', entry['name'])
+
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+from collections import OrderedDict
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+
+import edf
+
+__all__ = ['ingest', 'convert', 'load', 'query', 'read_manifest']
+
+
+_MANIFEST = 'manifest.json'
+"""Name of the manifest file in the cache directory."""
+
+_HEADER = 'header.json'
+"""Name of the header file in the directory of a cached recording."""
+
+_ARRAY_FIELDS = ['physical_min', 'physical_max', 'digital_min',
+                 'digital_max', 'samples_per_record']
+"""Header fields holding arrays."""
+
+
+def ingest(sources, cache_dir, processes=None, dtype=float):
+    """Convert many EDF files into the cache in parallel.
+
+    Files already in the cache are skipped unless they changed (size
+    or modification time) since they were converted. A file that fails
+    to convert is logged as a warning and left out, so the other files
+    are still added to the manifest.
+
+    Parameters
+    ----------
+    sources : A directory containing EDF files or a list of filenames.
+    cache_dir : The cache directory (created if needed).
+    processes : Number of worker processes (default: one per CPU).
+    dtype : The data type used to store the physical values.
+
+    Returns
+    -------
+    The list of manifest entries of the files converted successfully.
+
+    """
+    if isinstance(sources, str):
+        pattern = os.path.join(sources, '*')
+        sources = [f for f in sorted(glob.glob(pattern))
+                   if f.lower().endswith('.edf')]
+
+    os.makedirs(cache_dir, exist_ok=True)
+    worker = partial(_try_convert, cache_dir=cache_dir, dtype=dtype)
+
+    entries = []
+    with Pool(processes) as pool:
+        for filename, entry, error in pool.imap(worker, sources):
+            if error is None:
+                entries.append(entry)
+            else:
+                logging.warning('Could not convert %s: %s', filename, error)
+
+    manifest = OrderedDict((e['name'], e) for e in read_manifest(cache_dir))
+    for entry in entries:
+        manifest[entry['name']] = entry
+    _write_json(os.path.join(cache_dir, _MANIFEST), list(manifest.values()))
+
+    return entries
+
+
+def convert(edf_filename, cache_dir, dtype=float):
+    """Convert one EDF file into the cache.
+
+    The records are streamed into the per-signal .npy files, so memory
+    use does not grow with the length of the recording.
+
+    Parameters
+    ----------
+    edf_filename : Path to the EDF file.
+    cache_dir : The cache directory.
+    dtype : The data type used to store the physical values.
+
+    Returns
+    -------
+    The manifest entry of the cached recording.
+
+    """
+    name = _cache_name(edf_filename)
+    path = os.path.join(cache_dir, name)
+    stamp = edf._file_stamp(edf_filename)
+
+    if os.path.exists(os.path.join(path, _HEADER)):
+        header = _read_json(os.path.join(path, _HEADER))
+        if tuple(header['stamp']) == stamp:
+            return _manifest_entry(name, header)
+
+    staging = path + '.partial'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    try:
+        header, num_records = _write_signals(edf_filename, staging, dtype)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    header = _encode_header(header)
+    header['num_records'] = num_records
+    header['source'] = os.path.abspath(edf_filename)
+    header['stamp'] = list(stamp)
+    _write_json(os.path.join(staging, _HEADER), header)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(staging, path)
+
+    return _manifest_entry(name, header)
+
+
+def load(cache_dir, name, channels=None):
+    """Load a cached recording by memory-mapping its signals.
+
+    Parameters
+    ----------
+    cache_dir : The cache directory.
+    name : The name of the recording in the manifest.
+    channels : Labels or indices of the signals to load (default: all).
+
+    Returns
+    -------
+    A 2-tuple containing a dictionary of header fields and a
+    dictionary of (read-only, memory-mapped) signals.
+
+    """
+    path = os.path.join(cache_dir, name)
+    header = _decode_header(_read_json(os.path.join(path, _HEADER)))
+
+    signals = OrderedDict()
+    for channel in edf._channel_indices(header, channels):
+        filename = os.path.join(path, _signal_filename(channel))
+        signals[header['label'][channel]] = np.load(filename, mmap_mode='r')
+
+    return header, signals
+
+
+def query(cache_dir, label=None, rate=None, start_date=None):
+    """Find cached recordings using the manifest.
+
+    Parameters
+    ----------
+    cache_dir : The cache directory.
+    label : Only recordings with a signal with this label.
+    rate : Only recordings with a signal sampled at this rate (in Hz).
+        If label is also given, the rate of that signal must match.
+    start_date : Only recordings started on this (year, month, day), or
+        within an inclusive ((year, month, day), (year, month, day))
+        range. Years have four digits (see _start_date).
+
+    Returns
+    -------
+    The list of matching manifest entries.
+
+    """
+    if start_date is not None and np.ndim(start_date) == 2:
+        first, last = (tuple(d) for d in start_date)
+    elif start_date is not None:
+        first = last = tuple(start_date)
+
+    matches = []
+    for entry in read_manifest(cache_dir):
+        rates = entry['samples_per_sec']
+
+        if label is not None and label not in rates:
+            continue
+        if rate is not None:
+            candidates = rates.values() if label is None else [rates[label]]
+            if not any(np.isclose(r, rate) for r in candidates):
+                continue
+        if start_date is not None:
+            if not first <= tuple(entry['start_date']) <= last:
+                continue
+
+        matches.append(entry)
+
+    return matches
+
+
+def read_manifest(cache_dir):
+    """Read the list of manifest entries of a cache directory."""
+    filename = os.path.join(cache_dir, _MANIFEST)
+    if not os.path.exists(filename):
+        return []
+    return _read_json(filename)
+
+
+def _try_convert(edf_filename, cache_dir, dtype):
+    """Convert one EDF file, returning the error message if it fails."""
+    try:
+        return edf_filename, convert(edf_filename, cache_dir, dtype), None
+    except Exception as e:
+        return edf_filename, None, '{}: {}'.format(type(e).__name__, e)
+
+
+def _write_signals(edf_filename, staging, dtype):
+    """Stream the signals of an EDF file into .npy files in staging.
+
+    Returns
+    -------
+    A 2-tuple containing the header and the number of records.
+
+    """
+    with open(edf_filename, 'rb') as f:
+        header = edf._read_header(f)
+        num_records = edf._num_records(f, header)
+
+        signals = OrderedDict()
+        for channel, label in enumerate(header['label']):
+            filename = os.path.join(staging, _signal_filename(channel))
+            length = int(num_records * header['samples_per_record'][channel])
+            signals[label] = np.lib.format.open_memmap(
+                filename, mode='w+', dtype=dtype, shape=(length,))
+
+        for r, record in enumerate(edf.iter_records(f, header)):
+            for label, signal in record.items():
+                n = len(signal)
+                signals[label][r * n:(r + 1) * n] = signal
+
+        for signal in signals.values():
+            signal.flush()
+        del signals
+
+    return header, num_records
+
+
+def _manifest_entry(name, header):
+    """Summarise an encoded header for the manifest."""
+    samples = np.array(header['samples_per_record'])
+    rates = samples / header['seconds_per_record']
+    entry = OrderedDict()
+    entry['name'] = name
+    entry['source'] = header['source']
+    entry['start_date'] = _start_date(header)
+    entry['start_time'] = header['start_time']
+    entry['num_records'] = header['num_records']
+    entry['seconds_per_record'] = header['seconds_per_record']
+    entry['samples_per_sec'] = OrderedDict(zip(header['label'],
+                                               rates.tolist()))
+    return entry
+
+
+def _start_date(header):
+    """The [year, month, day] of an encoded header's start date.
+
+    The EDF field is dd.mm.yy, which edf stores in that order. Two
+    digit years are expanded by the EDF rule: 85-99 are 1985-1999 and
+    00-84 are 2000-2084.
+
+    """
+    day, month, year = header['start_date']
+    year += 1900 if year >= 85 else 2000
+    return [year, month, day]
+
+
+def _encode_header(header):
+    """Convert a header dictionary to JSON serialisable values."""
+    encoded = OrderedDict()
+    for field, value in header.items():
+        if isinstance(value, np.ndarray):
+            value = value.tolist()
+        elif isinstance(value, tuple):
+            value = list(value)
+        encoded[field] = value
+    return encoded
+
+
+def _decode_header(encoded):
+    """Convert a JSON header back to the values used by edf."""
+    header = OrderedDict(encoded)
+    header['start_date'] = edf.StartDate(*header['start_date'])
+    header['start_time'] = edf.StartTime(*header['start_time'])
+    for field in _ARRAY_FIELDS:
+        header[field] = np.array(header[field])
+    return header
+
+
+def _cache_name(edf_filename):
+    """A name for a file in the cache that is unique to its path."""
+    stem = os.path.splitext(os.path.basename(edf_filename))[0]
+    path = os.path.abspath(edf_filename).encode('utf-8')
+    return '{}-{}'.format(stem, hashlib.sha1(path).hexdigest()[:8])
+
+
+def _signal_filename(channel):
+    """The name of the .npy file holding a signal."""
+    return 'signal{:03d}.npy'.format(channel)
+
+
+def _read_json(filename):
+    """Read a JSON file preserving the order of objects."""
+    with open(filename) as f:
+        return json.load(f, object_pairs_hook=OrderedDict)
+
+
+def _write_json(filename, obj):
+    """Write an object to a JSON file."""
+    with open(filename, 'w') as f:
+        json.dump(obj, f, indent=2)
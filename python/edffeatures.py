@@ -0,0 +1,151 @@
+"""Per-epoch summary statistics of EDF recordings.
+
+Features are computed in a single streaming pass over the epochs of a
+recording (see edf.iter_epochs), so memory use is bounded by the size
+of one epoch no matter how long the recording is. The result is a
+structured array with one row per (epoch, signal) pair, ordered by
+epoch and then by the order of the signals in the header:
+
+>>> table = epoch_features('night.edf', 30, bands={'delta': (0.5, 4)})
+>>> table[table['label'] == 'EEG Fpz-Cz']['delta']
+
+"""
+from collections import OrderedDict
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+
+import edf
+
+__all__ = ['epoch_features', 'epoch_features_many', 'STATISTICS']
+
+
+STATISTICS = OrderedDict([
+    ('mean', lambda x: x.mean(axis=-1)),
+    ('var', lambda x: x.var(axis=-1)),
+    ('min', lambda x: x.min(axis=-1)),
+    ('max', lambda x: x.max(axis=-1)),
+    ('rms', lambda x: np.sqrt(np.mean(x**2, axis=-1))),
+])
+"""Available statistics of the samples in an epoch."""
+
+_EPOCHS_PER_CHUNK = 64
+"""Number of epochs whose features are computed together."""
+
+
+def epoch_features(edf_filename, epoch_seconds, statistics=tuple(STATISTICS),
+                   bands=None, channels=None):
+    """Compute features of each epoch of each signal in an EDF file.
+
+    Parameters
+    ----------
+    edf_filename : Path to the EDF file.
+    epoch_seconds : The length of each epoch in seconds.
+    statistics : Names of the statistics (keys of STATISTICS) to compute.
+    bands : A dictionary mapping names to (low, high) frequency ranges in
+        Hz. The power of each epoch in each band [low, high) is computed
+        from the periodogram.
+    channels : Labels or indices of the signals to use (default: all).
+
+    Returns
+    -------
+    A structured array with an 'epoch' index, a 'label' and a 'start'
+    time (in seconds) in each row, and a column for each feature.
+
+    """
+    bands = OrderedDict() if bands is None else OrderedDict(bands)
+    features = list(statistics) + list(bands)
+    dtype = [('epoch', int), ('label', 'U16'), ('start', float)]
+    dtype += [(name, float) for name in features]
+
+    with open(edf_filename, 'rb') as f:
+        header = edf._read_header(f)
+        rates = edf.samples_per_sec(header)
+        epochs = edf.iter_epochs(f, header, epoch_seconds, channels=channels)
+
+        chunks, ordinals = [], []
+        for first, chunk in _chunks(epochs, _EPOCHS_PER_CHUNK):
+            for ordinal, (label, signal) in enumerate(chunk.items()):
+                table = np.zeros(len(signal), dtype)
+                table['epoch'] = first + np.arange(len(signal))
+                table['label'] = label
+                table['start'] = table['epoch'] * epoch_seconds
+
+                for name in statistics:
+                    table[name] = STATISTICS[name](signal)
+
+                if bands:
+                    power = _band_power(signal, rates[label], bands)
+                    for name, values in power.items():
+                        table[name] = values
+
+                chunks.append(table)
+                ordinals.append(np.full(len(signal), ordinal))
+
+    if not chunks:
+        return np.zeros(0, dtype)
+
+    table = np.concatenate(chunks)
+    return table[np.lexsort((np.concatenate(ordinals), table['epoch']))]
+
+
+def epoch_features_many(edf_filenames, epoch_seconds, processes=None,
+                        **kwargs):
+    """Compute epoch features of many EDF files in parallel.
+
+    Parameters
+    ----------
+    edf_filenames : Paths to the EDF files.
+    epoch_seconds : The length of each epoch in seconds.
+    processes : Number of worker processes (default: one per CPU).
+    kwargs : Other arguments passed to epoch_features.
+
+    Returns
+    -------
+    A dictionary mapping each filename to its feature table.
+
+    """
+    worker = partial(epoch_features, epoch_seconds=epoch_seconds, **kwargs)
+
+    with Pool(processes) as pool:
+        tables = pool.map(worker, edf_filenames, chunksize=1)
+
+    return OrderedDict(zip(edf_filenames, tables))
+
+
+def _chunks(epochs, size):
+    """Stack consecutive epochs into (epochs x samples) matrices."""
+    first = 0
+    pending = []
+
+    for epoch in epochs:
+        pending.append(epoch)
+        if len(pending) == size:
+            yield first, _stack(pending)
+            first += len(pending)
+            pending = []
+
+    if pending:
+        yield first, _stack(pending)
+
+
+def _stack(epochs):
+    """Stack the signals of a list of epochs by label."""
+    return OrderedDict((label, np.vstack([e[label] for e in epochs]))
+                       for label in epochs[0])
+
+
+def _band_power(signal, rate, bands):
+    """Power in frequency bands of each row of a matrix of samples."""
+    num_samples = signal.shape[-1]
+    spectrum = np.abs(np.fft.rfft(signal, axis=-1))**2 / num_samples**2
+    spectrum[..., 1:(num_samples + 1) // 2] *= 2
+    freqs = np.fft.rfftfreq(num_samples, 1.0 / rate)
+
+    power = OrderedDict()
+    for name, (low, high) in bands.items():
+        in_band = (freqs >= low) & (freqs < high)
+        power[name] = spectrum[..., in_band].sum(axis=-1)
+
+    return power
@@ -0,0 +1,271 @@
+"""Multi-resolution summaries of EDF signals for fast zooming.
+
+A pyramid index stores the minimum, maximum and mean of consecutive
+buckets of samples of every signal. Level 0 summarises buckets of
+`bucket_size` samples and each following level halves the resolution,
+so level k summarises buckets of `bucket_size * 2**k` samples. The
+index is built in one streaming pass over the records of a file and
+is kept in a sidecar file next to it:
+
+>>> index = open_index('night.edf')
+>>> times, mins, maxs, means = index.query('EEG Fpz-Cz', 0, 3600, 1000)
+
+The sidecar records the size and modification time of the EDF file
+and is rebuilt by open_index when either changes.
+
+"""
+import os
+
+from collections import OrderedDict
+
+import numpy as np
+
+import edf
+
+__all__ = ['PyramidIndex', 'open_index', 'sidecar_filename']
+
+
+_SIDECAR_SUFFIX = '.pyramid.npz'
+"""Suffix appended to the EDF filename to name the sidecar file."""
+
+_DEFAULT_BUCKET_SIZE = 64
+"""Default number of samples summarised by each bucket of level 0."""
+
+
+class PyramidIndex:
+    """Min/max/mean summaries of the signals of an EDF file."""
+
+    def __init__(self, levels, rates, bucket_size, stamp):
+        self._levels = levels
+        self._rates = rates
+        self._bucket_size = int(bucket_size)
+        self._stamp = tuple(stamp)
+
+    @property
+    def labels(self):
+        """The labels of the indexed signals."""
+        return list(self._levels)
+
+    @property
+    def bucket_size(self):
+        """The number of samples summarised by a bucket of level 0."""
+        return self._bucket_size
+
+    def num_levels(self, label):
+        """The number of levels in the pyramid of a signal."""
+        return len(self._levels[label])
+
+    def level(self, label, k):
+        """The (min, max, mean) arrays of one level of a signal."""
+        return self._levels[label][k]
+
+    def query(self, label, start=0.0, stop=None, num_points=1000):
+        """Summarise a time window of a signal at a given resolution.
+
+        The coarsest level holding at least num_points buckets in the
+        window is used, so the result has between num_points and
+        2 * num_points buckets unless the window is shorter than
+        num_points level 0 buckets.
+
+        Parameters
+        ----------
+        label : The label of the signal.
+        start : Start of the window in seconds (earlier times are
+            clipped to the start of the recording).
+        stop : End of the window in seconds (default: the end).
+        num_points : The desired number of buckets (e.g. pixels).
+
+        Returns
+        -------
+        A 4-tuple of arrays holding the start time (in seconds), the
+        minimum, the maximum, and the mean of each bucket.
+
+        """
+        rate = self._rates[label]
+        levels = self._levels[label]
+
+        start = max(start, 0.0)
+        if stop is None:
+            stop = len(levels[0][0]) * self._bucket_size / rate
+
+        num_samples = max(stop - start, 0.0) * rate
+        k = 0
+        while (k + 1 < len(levels) and
+               num_samples / self._scale(k + 1) >= num_points):
+            k += 1
+
+        scale = self._scale(k)
+        lo = int(start * rate // scale)
+        hi = int(np.ceil(stop * rate / scale))
+
+        mins, maxs, means = (a[lo:hi] for a in levels[k])
+        times = np.arange(lo, lo + len(mins)) * scale / rate
+
+        return times, mins, maxs, means
+
+    def is_current(self, edf_filename):
+        """Check if the index was built from the file in its current state."""
+        return self._stamp == edf._file_stamp(edf_filename)
+
+    def save(self, filename):
+        """Write the index to a file."""
+        arrays = OrderedDict()
+        arrays['labels'] = np.array(self.labels)
+        arrays['rates'] = np.array([self._rates[l] for l in self.labels])
+        arrays['bucket_size'] = np.array(self._bucket_size)
+        arrays['stamp'] = np.array(self._stamp)
+
+        for c, label in enumerate(self.labels):
+            for k, (mins, maxs, means) in enumerate(self._levels[label]):
+                arrays['c{}_l{}_min'.format(c, k)] = mins
+                arrays['c{}_l{}_max'.format(c, k)] = maxs
+                arrays['c{}_l{}_mean'.format(c, k)] = means
+
+        with open(filename, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        """Read an index from a file written by save."""
+        with np.load(filename) as arrays:
+            labels = [str(l) for l in arrays['labels']]
+            rates = OrderedDict(zip(labels, arrays['rates'].tolist()))
+
+            levels = OrderedDict()
+            for c, label in enumerate(labels):
+                levels[label] = []
+                key = 'c{}_l{}_'.format(c, 0)
+                while key + 'min' in arrays:
+                    stats = ('min', 'max', 'mean')
+                    levels[label].append(tuple(arrays[key + s] for s in stats))
+                    key = 'c{}_l{}_'.format(c, len(levels[label]))
+
+            return cls(levels, rates, arrays['bucket_size'], arrays['stamp'])
+
+    @classmethod
+    def build(cls, edf_filename, bucket_size=_DEFAULT_BUCKET_SIZE,
+              channels=None):
+        """Build an index in one streaming pass over an EDF file.
+
+        Parameters
+        ----------
+        edf_filename : Path to the EDF file.
+        bucket_size : The number of samples in a bucket of level 0.
+        channels : Labels or indices of the signals to index (default: all).
+
+        Returns
+        -------
+        A new PyramidIndex.
+
+        """
+        stamp = edf._file_stamp(edf_filename)
+
+        with open(edf_filename, 'rb') as f:
+            header = edf._read_header(f)
+            channels = edf._channel_indices(header, channels)
+            builders = OrderedDict()
+            for channel in channels:
+                label = header['label'][channel]
+                builders[label] = _LevelBuilder(bucket_size)
+
+            for record in edf.iter_records(f, header, channels=channels):
+                for label, signal in record.items():
+                    builders[label].add(signal)
+
+        rates = edf.samples_per_sec(header)
+        rates = OrderedDict((l, rates[l]) for l in builders)
+        levels = OrderedDict((l, b.levels()) for l, b in builders.items())
+
+        return cls(levels, rates, bucket_size, stamp)
+
+    def _scale(self, k):
+        """The number of samples summarised by a bucket of level k."""
+        return self._bucket_size * 2**k
+
+
+def open_index(edf_filename, bucket_size=_DEFAULT_BUCKET_SIZE):
+    """Load the index of an EDF file, building it if needed.
+
+    The sidecar file is (re)built when it does not exist, when the EDF
+    file has changed since it was written, or when it was built with a
+    different bucket size.
+
+    Parameters
+    ----------
+    edf_filename : Path to the EDF file.
+    bucket_size : The number of samples in a bucket of level 0.
+
+    Returns
+    -------
+    A PyramidIndex for the file.
+
+    """
+    filename = sidecar_filename(edf_filename)
+
+    if os.path.exists(filename):
+        index = PyramidIndex.load(filename)
+        if (index.is_current(edf_filename) and
+                index.bucket_size == bucket_size):
+            return index
+
+    index = PyramidIndex.build(edf_filename, bucket_size)
+    index.save(filename)
+
+    return index
+
+
+def sidecar_filename(edf_filename):
+    """The name of the sidecar file holding the index of an EDF file."""
+    return edf_filename + _SIDECAR_SUFFIX
+
+
+class _LevelBuilder:
+    """Accumulate the bucket summaries of one signal."""
+
+    def __init__(self, bucket_size):
+        self._bucket_size = bucket_size
+        self._pending = np.empty(0)
+        self._mins = [np.empty(0)]
+        self._maxs = [np.empty(0)]
+        self._sums = [np.empty(0)]
+        self._counts = [np.empty(0)]
+
+    def add(self, signal):
+        """Summarise the complete buckets of a new chunk of samples."""
+        n = self._bucket_size
+        samples = np.concatenate([self._pending, signal])
+        num_full = len(samples) // n * n
+        self._pending = samples[num_full:]
+        self._append(samples[:num_full].reshape(-1, n))
+
+    def levels(self):
+        """Finish the pass and return the (min, max, mean) of each level."""
+        if len(self._pending):
+            self._append(self._pending[None, :])
+            self._pending = np.empty(0)
+
+        mins, maxs, sums, counts = (np.concatenate(a) for a in (
+            self._mins, self._maxs, self._sums, self._counts))
+        levels = [(mins, maxs, sums / counts)]
+
+        while len(sums) > 1:
+            mins = _pairwise(mins, np.minimum)
+            maxs = _pairwise(maxs, np.maximum)
+            sums = _pairwise(sums, np.add)
+            counts = _pairwise(counts, np.add)
+            levels.append((mins, maxs, sums / counts))
+
+        return levels
+
+    def _append(self, buckets):
+        """Summarise the rows of a matrix of buckets."""
+        self._mins.append(buckets.min(axis=1))
+        self._maxs.append(buckets.max(axis=1))
+        self._sums.append(buckets.sum(axis=1))
+        self._counts.append(np.full(len(buckets), buckets.shape[1], float))
+
+
+def _pairwise(a, combine):
+    """Combine neighbouring pairs of elements of an array."""
+    head = combine(a[0:len(a) - 1:2], a[1::2])
+    return np.concatenate([head, a[-1:]]) if len(a) % 2 else head
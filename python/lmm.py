@@ -1,18 +1,90 @@
 """Linear Mixed Model (LMM)"""
 
+import json
 import logging
+import os
 import numpy as np
 import scipy.linalg as la
 
-from scipy.stats import multivariate_normal as mvn
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+from functools import partial, reduce
+from itertools import chain, islice
+from multiprocessing import Pipe, Process, cpu_count
+from time import perf_counter, process_time
+
+
+SufficientStats = namedtuple('SufficientStats', [
+    'ZtZ', 'ZtX', 'Zty', 'XtX', 'Xty', 'yty', 'num_obs'])
+"""Statistics of a dataset that are all EM needs.
+
+ZtZ, ZtX and Zty are stacked with one row per subject; XtX, Xty, yty
+and num_obs are totals over the subjects.
+"""
+
+_SUBJECTS_PER_CHUNK = 2**14
+"""Number of subjects whose statistics are computed or used at once."""
+
+_STATS_FIELDS = ['ZtZ', 'ZtX', 'Zty']
+"""Fields of SufficientStats holding one row per subject."""
+
+_TOTAL_FIELDS = ['XtX', 'Xty', 'yty', 'num_obs']
+"""Fields of SufficientStats holding totals over the subjects."""
+
+_EStepSums = namedtuple('_EStepSums', [
+    'logl', 'ranef_moment', 'ZtXm', 'mZty', 'mZtZm', 'trZtZS',
+    'num_subjects'])
 
 
 class LinearMixedModel:
 
     def __init__(self, p1, p2):
-        self._coef = np.zeros(p1)
-        self._ranef_cov = np.eye(p2)
-        self._noise_var = 1.0
+        self.set_params(np.zeros(p1), np.eye(p2), 1.0)
+
+    def set_params(self, coef, ranef_cov, noise_var):
+        """Set the parameters, caching the inverse of ranef_cov.
+
+        The parameters and the cache are read-only attributes holding
+        read-only arrays, so this is the only way to change them and
+        the cache cannot fall out of step with ranef_cov.
+
+        """
+        coef = np.array(coef, dtype=float)
+        ranef_cov = np.array(ranef_cov, dtype=float)
+
+        factor = la.cho_factor(ranef_cov, lower=True)
+        ranef_prec = la.cho_solve(factor, np.eye(len(ranef_cov)))
+        ranef_logdet = 2 * np.log(np.diag(factor[0])).sum()
+
+        for array in [coef, ranef_cov, ranef_prec]:
+            array.flags.writeable = False
+        self._params = (coef, ranef_cov, float(noise_var), ranef_prec,
+                        ranef_logdet)
+
+    @property
+    def _coef(self):
+        """The fixed effect coefficients."""
+        return self._params[0]
+
+    @property
+    def _ranef_cov(self):
+        """The covariance of the random effects."""
+        return self._params[1]
+
+    @property
+    def _noise_var(self):
+        """The variance of the measurement noise."""
+        return self._params[2]
+
+    @property
+    def _ranef_prec(self):
+        """The cached inverse of the random effects covariance."""
+        return self._params[3]
+
+    @property
+    def _ranef_logdet(self):
+        """The cached log determinant of the random effects covariance."""
+        return self._params[4]
 
     def param_copy(self):
         beta = np.array(self._coef)
@@ -21,75 +93,864 @@ class LinearMixedModel:
         return beta, Sigma, v
 
     def log_likelihood(self, y, X, Z):
+        return self._posterior_terms(y, X, Z)[2]
+
+    def posterior(self, y, X, Z):
+        m, S, _ = self._posterior_terms(y, X, Z)
+        return m, S
+
+    def prior(self):
+        """The prior mean and covariance of the random effects."""
+        return np.zeros(len(self._ranef_cov)), np.array(self._ranef_cov)
+
+    def posteriors(self, dataset):
+        """Compute the posteriors of many subjects at once.
+
+        The subjects are reduced to their sufficient statistics and all
+        posteriors are found by batched solves against the cached
+        inverse of the random-effects covariance.
+
+        Parameters
+        ----------
+        dataset : A list of (y, X, Z) tuples, one per subject, or their
+            SufficientStats.
+
+        Returns
+        -------
+        The posterior means, an array of shape (len(dataset), p2), and
+        covariances, an array of shape (len(dataset), p2, p2).
+
+        """
+        if not isinstance(dataset, SufficientStats):
+            dataset = sufficient_stats(dataset)
+        _, _, m, S = _batch_posterior(self, dataset.ZtZ, dataset.ZtX,
+                                      dataset.Zty)
+        return m, S
+
+    def update_posterior(self, m, S, y, X, Z):
+        """Fold new observations of a subject into its posterior.
+
+        This is the Kalman filter update: with k new observations only
+        a k x k matrix is factorised, and the result is the posterior
+        given both the old and the new observations. Starting from the
+        prior gives the posterior of the new observations alone.
+
+        Parameters
+        ----------
+        m : The current posterior mean.
+        S : The current posterior covariance.
+        y : The new observations.
+        X : The fixed effects design of the new observations.
+        Z : The random effects design of the new observations.
+
+        Returns
+        -------
+        The updated posterior mean and covariance.
+
+        """
+        y, X, Z = np.atleast_1d(y), np.atleast_2d(X), np.atleast_2d(Z)
+        resid = y - np.dot(X, self._coef) - np.dot(Z, m)
+        ZS = np.dot(Z, S)
+        cov = np.dot(ZS, Z.T) + self._noise_var * np.eye(len(y))
+        gain = la.cho_solve(la.cho_factor(cov, lower=True), ZS).T
+        S = S - np.dot(gain, ZS)
+        return m + np.dot(gain, resid), (S + S.T) / 2
+
+    def predict(self, m, S, X, Z, noise=False):
+        """Predict the trajectories of subjects given their posteriors.
+
+        Parameters
+        ----------
+        m : A posterior mean, or stacked means of many subjects.
+        S : A posterior covariance, or stacked covariances.
+        X : The fixed effects design of the inputs (e.g. basis(xgrid)).
+        Z : The random effects design of the inputs.
+        noise : Include the noise variance in the predictive variance.
+
+        Returns
+        -------
+        The predictive means and variances at each input, with a row
+        per subject if many posteriors were given.
+
+        """
+        mean = np.dot(X, self._coef) + np.dot(m, Z.T)
+        var = np.einsum('gj,...jk,gk->...g', Z, S, Z)
+        if noise:
+            var = var + self._noise_var
+        return mean, var
+
+    def _posterior_terms(self, y, X, Z):
+        """Random effects posterior and marginal log likelihood of a subject.
+
+        Only p2 x p2 matrices are factorised. With precision
+        P = inv(Sigma) + Z'Z / v of the posterior, the determinant lemma
+        gives log|Z Sigma Z' + vI| = n log(v) + log|Sigma| + log|P| and
+        the Woodbury identity gives the quadratic form of the residual
+        r as (r'r - r'Z m) / v, where m is the posterior mean.
+
+        """
+        v = self._noise_var
+        eye = np.eye(len(self._ranef_cov))
+        resid = y - np.dot(X, self._coef)
+        Ztr = np.dot(Z.T, resid)
+
+        P = self._ranef_prec + np.dot(Z.T, Z) / v
+        P_factor = la.cho_factor(P, lower=True)
+        m = la.cho_solve(P_factor, Ztr / v)
+        S = la.cho_solve(P_factor, eye)
+
+        logdet = len(y) * np.log(v) + self._ranef_logdet
+        logdet += 2 * np.log(np.diag(P_factor[0])).sum()
+        quad = (np.dot(resid, resid) - np.dot(Ztr, m)) / v
+        logl = -0.5 * (len(y) * np.log(2 * np.pi) + logdet + quad)
+
+        return m, S, logl
+
+    def _log_likelihood_dense(self, y, X, Z):
+        from scipy.stats import multivariate_normal as mvn
+
         m = np.dot(X, self._coef)
         S = np.dot(Z, np.dot(self._ranef_cov, Z.T))
         S += self._noise_var * np.eye(len(y))
         return mvn.logpdf(y, m, S)
 
-    def posterior(self, y, X, Z):
-        resid = y - np.dot(X, self._coef)
-        P = la.inv(self._ranef_cov) + np.dot(Z.T, Z) / self._noise_var
-        S = la.inv(P)
-        m = la.solve(P, np.dot(Z.T, resid) / self._noise_var)
-        return m, S
 
+def learn_lmm(dataset, maxiter=500, tol=1e-5, processes=1, method='em',
+              full_output=False, init=None, callback=None, checkpoint=None,
+              checkpoint_every=10):
+    """Fit a linear mixed model by maximum likelihood.
+
+    There are three methods. 'em' iterates the EM map. 'squarem'
+    extrapolates two EM steps at a time (Varadhan and Roland, Simple
+    and globally convergent methods for accelerating the convergence of
+    any EM algorithm, 2008), falling back to the plain EM step whenever
+    the extrapolated step does not increase the log likelihood.
+    'direct' maximises the log likelihood by L-BFGS over beta, the
+    Cholesky factor of the random-effects covariance and log(v), with
+    gradients computed from the same E-step sums EM uses.
+
+    With more than one process the subjects are split into one shard
+    per worker process. Each worker computes and keeps the sufficient
+    statistics of its shard, so each iteration only sends the
+    parameters to the workers and sums the small E-step results they
+    send back.
+
+    The data need not fit in memory. Instead of a list of subjects,
+    dataset may be a callable returning an iterator of batches (lists
+    of subjects), whose statistics are computed in one streaming pass,
+    or SufficientStats, such as those memory-mapped by read_stats from
+    a store written by write_stats. The E-step works through the
+    statistics in chunks, so memory use is bounded either way.
+
+    Each iteration produces a record (a dictionary) with the
+    'iteration', the log likelihood 'logl', its relative change
+    'delta', the norms of the changes of the parameters
+    ('coef_change', 'ranef_cov_change' and 'noise_var_change'), the
+    number of 'passes' so far, and the 'wall' and 'cpu' seconds since
+    the fit started. A long fit can be resumed by passing the
+    checkpoint file it wrote as init.
+
+    Parameters
+    ----------
+    dataset : A list of (y, X, Z) tuples, one per subject, a callable
+        returning an iterator of lists of such tuples, or
+        SufficientStats.
+    maxiter : The largest number of iterations (counting those of the
+        fit a checkpoint was written by).
+    tol : Stop when the relative increase of the log likelihood is
+        smaller than this.
+    processes : Number of worker processes (None for one per CPU).
+    method : One of 'em', 'squarem' or 'direct'.
+    full_output : Also return a dictionary with the 'method', the
+        number of 'iterations', the number of 'passes' (E-steps) over
+        the data, the final log likelihood 'logl', the 'history' of
+        iteration records, and the 'timers' of each phase of the fit
+        as {phase: {'wall': seconds, 'cpu': seconds, 'calls': count}}.
+        CPU time is that of this process only.
+    init : A LinearMixedModel or the name of a checkpoint file to start
+        from (default: beta = 0, Sigma = I, v = 1).
+    callback : Called as callback(record, lmm) after each iteration;
+        the fit stops if it returns True.
+    checkpoint : The name of a file to which the parameters and the
+        iteration state are written (see load_checkpoint).
+    checkpoint_every : Write the checkpoint every this many iterations
+        (and when the fit ends).
+
+    Returns
+    -------
+    The fitted LinearMixedModel (and the dictionary if full_output).
+
+    """
+    learn = _METHODS[method]
+    monitor = _Monitor(maxiter, tol, callback, checkpoint, checkpoint_every)
+
+    if processes is None:
+        processes = cpu_count()
+
+    with monitor.timer('stats'):
+        if callable(dataset):
+            dataset = sufficient_stats(chain.from_iterable(dataset()))
+        elif processes == 1 and not isinstance(dataset, SufficientStats):
+            dataset = sufficient_stats(dataset)
+
+    if isinstance(dataset, SufficientStats):
+        p1, p2 = dataset.ZtX.shape[2], dataset.ZtX.shape[1]
+    else:
+        p1, p2 = dataset[0][1].shape[1], dataset[0][2].shape[1]
 
-def learn_lmm(dataset, maxiter=500, tol=1e-5):
-    objective = lambda lmm: sum(lmm.log_likelihood(*d) for d in dataset)
-    
-    p1 = dataset[0][1].shape[1]
-    p2 = dataset[0][2].shape[1]
     lmm = LinearMixedModel(p1, p2)
+    if isinstance(init, LinearMixedModel):
+        lmm.set_params(*init.param_copy())
+    elif init is not None:
+        lmm, state = load_checkpoint(init)
+        monitor.iteration = state['iteration']
+
+    if processes == 1:
+        monitor.e_step = partial(_e_step, dataset)
+        learn(lmm, dataset, monitor)
+    else:
+        with monitor.timer('stats'):
+            sharded = _ShardedEStep(dataset, processes)
+        with sharded:
+            monitor.e_step = sharded
+            learn(lmm, sharded.stats, monitor)
+
+    monitor.save(lmm)
+
+    if full_output:
+        return lmm, monitor.info(method)
 
-    logl = objective(lmm)
+    return lmm
 
-    for iteration in range(maxiter):
-        lmm._coef, lmm._ranef_cov, lmm._noise_var = em_step(dataset, lmm)
 
-        logl_old = logl
-        logl = objective(lmm)
+def load_checkpoint(filename):
+    """Read a checkpoint written by learn_lmm.
 
-        delta = (logl - logl_old) / np.abs(logl_old)
+    Returns
+    -------
+    The LinearMixedModel and a dictionary with the 'iteration' and the
+    log likelihood 'logl' at which the checkpoint was written.
 
-        msg = 'Iteration={:05d} LL={:20.8f}, dLL={:20.8f}'
-        logging.info(msg.format(iteration, logl, delta))
+    """
+    with np.load(filename) as arrays:
+        p1, p2 = len(arrays['coef']), len(arrays['ranef_cov'])
+        lmm = LinearMixedModel(p1, p2)
+        lmm.set_params(arrays['coef'], arrays['ranef_cov'],
+                       arrays['noise_var'])
+        state = {'iteration': int(arrays['iteration']),
+                 'logl': float(arrays['logl'])}
+    return lmm, state
+
+
+def _learn_em(lmm, stats, monitor):
+    """Run EM given the totals of the statistics."""
+    sums = monitor.start(lmm)
 
-        if delta < tol:
+    while monitor.running():
+        with monitor.timer('m_step'):
+            lmm.set_params(*_m_step(stats, sums))
+        sums = monitor.e_step_of(lmm)
+
+        if monitor.record(lmm, sums.logl):
+            break
+
+
+def _learn_squarem(lmm, stats, monitor):
+    """Run SQUAREM (scheme S3) on the EM map.
+
+    The extrapolation is done on the parameter vector of _pack, where
+    every vector maps to valid parameters.
+
+    """
+    p1, p2 = len(lmm._coef), len(lmm._ranef_cov)
+    sums = monitor.start(lmm)
+
+    while monitor.running():
+        theta0 = _pack(*lmm.param_copy())
+        with monitor.timer('m_step'):
+            params1 = _m_step(stats, sums)
+        lmm.set_params(*params1)
+        sums1 = monitor.e_step_of(lmm)
+        with monitor.timer('m_step'):
+            params2 = _m_step(stats, sums1)
+
+        with monitor.timer('extrapolate'):
+            r = _pack(*params1) - theta0
+            d = _pack(*params2) - 2 * _pack(*params1) + theta0
+            tiny = np.finfo(float).tiny
+            alpha = min(-np.sqrt(np.dot(r, r) / max(np.dot(d, d), tiny)),
+                        -1.0)
+            theta = theta0 - 2 * alpha * r + alpha**2 * d
+
+        try:
+            with np.errstate(over='ignore', invalid='ignore'):
+                lmm.set_params(*_unpack(theta, p1, p2))
+                sums = monitor.e_step_of(lmm)
+                with monitor.timer('m_step'):
+                    lmm.set_params(*_m_step(stats, sums))
+                sums = monitor.e_step_of(lmm)
+            accepted = np.isfinite(sums.logl) and sums.logl >= sums1.logl
+        except (np.linalg.LinAlgError, ValueError):
+            accepted = False
+
+        if not accepted:
+            lmm.set_params(*params2)
+            sums = monitor.e_step_of(lmm)
+
+        if monitor.record(lmm, sums.logl, step=-alpha, accepted=accepted):
             break
 
-    return lmm
+
+def _learn_direct(lmm, stats, monitor):
+    """Maximise the log likelihood by L-BFGS with analytic gradients."""
+    from scipy.optimize import minimize
+
+    p1, p2 = len(lmm._coef), len(lmm._ranef_cov)
+    evaluated = {}
+
+    def objective(theta):
+        lmm.set_params(*_unpack(theta, p1, p2))
+        sums = monitor.e_step_of(lmm)
+        evaluated['theta'], evaluated['logl'] = np.array(theta), sums.logl
+        return -sums.logl, -_gradient(lmm, stats, sums)
+
+    def iteration_done(theta):
+        if not np.array_equal(theta, evaluated['theta']):
+            objective(theta)
+        if monitor.record(lmm, evaluated['logl']):
+            raise _StopFit()
+
+    monitor.start(lmm)
+    theta = _pack(*lmm.param_copy())
+    maxiter = monitor.maxiter - monitor.iteration
+    try:
+        result = minimize(objective, theta, jac=True, method='L-BFGS-B',
+                          callback=iteration_done,
+                          options={'maxiter': max(maxiter, 0), 'ftol': 0})
+        theta = result.x
+    except _StopFit:
+        theta = evaluated['theta']
+
+    lmm.set_params(*_unpack(theta, p1, p2))
+
+
+_METHODS = {'em': _learn_em, 'squarem': _learn_squarem,
+            'direct': _learn_direct}
 
 
 def em_step(dataset, lmm):
-    ss1 = 0.0
-    ss2 = 0.0
-    ss3 = 0.0
-    ss4 = 0.0
-    ss5 = 0.0
+    stats = sufficient_stats(dataset)
+    return _m_step(stats, _e_step(stats, lmm))
+
 
-    for y, X, Z in dataset:
-        m_i, S_i = lmm.posterior(y, X, Z)
+def sufficient_stats(dataset):
+    """Compute the sufficient statistics of a dataset in one pass.
 
-        ss1 += np.dot(X.T, X)
-        ss2 += np.dot(X.T, y - np.dot(Z, m_i))
+    The subjects are consumed in chunks, and subjects of a chunk with
+    the same number of observations are stacked so that their cross
+    products are computed by one batched product.
 
-        ss3 += S_i + np.outer(m_i, m_i)
+    Parameters
+    ----------
+    dataset : An iterable of (y, X, Z) tuples, one per subject.
+
+    Returns
+    -------
+    The SufficientStats of the dataset.
+
+    """
+    chunks = list(_stats_chunks(dataset))
+    if not chunks:
+        raise ValueError('The dataset has no subjects.')
+
+    rows = [np.concatenate([getattr(c, f) for c in chunks])
+            for f in _STATS_FIELDS]
+    totals = [sum(getattr(c, f) for c in chunks) for f in _TOTAL_FIELDS]
+    return SufficientStats(*(rows + totals))
+
+
+def write_stats(dataset, path):
+    """Compute sufficient statistics in one pass and store them on disk.
 
-        ss4 += len(y)        
+    Only one chunk of subjects is held in memory at a time. The store
+    is a directory holding a raw file of each per-subject field and
+    the totals and shapes in meta.json.
 
-    b = la.solve(ss1, ss2)
-    S = ss3 / len(dataset)
+    Parameters
+    ----------
+    dataset : An iterable of (y, X, Z) tuples, one per subject.
+    path : The directory of the store (created if needed).
 
-    for y, X, Z in dataset:
-        m_i, S_i = lmm.posterior(y, X, Z)
-        ss5 += np.sum((y - np.dot(X, b) - np.dot(Z, m_i))**2)
-        ss5 += np.diag(np.dot(Z.T, Z) * S_i).sum()
+    """
+    os.makedirs(path, exist_ok=True)
+    files = [open(_stats_filename(path, f), 'wb') for f in _STATS_FIELDS]
+    totals = [0] * len(_TOTAL_FIELDS)
+    num_subjects = 0
+
+    try:
+        for chunk in _stats_chunks(dataset):
+            for f, field in zip(files, _STATS_FIELDS):
+                getattr(chunk, field).tofile(f)
+            totals = [t + getattr(chunk, f)
+                      for t, f in zip(totals, _TOTAL_FIELDS)]
+            num_subjects += len(chunk.ZtZ)
+            shapes = {f: [num_subjects] + list(getattr(chunk, f).shape[1:])
+                      for f in _STATS_FIELDS}
+    finally:
+        for f in files:
+            f.close()
+
+    if not num_subjects:
+        raise ValueError('The dataset has no subjects.')
+
+    XtX, Xty, yty, num_obs = totals
+    meta = {'shapes': shapes, 'XtX': XtX.tolist(), 'Xty': Xty.tolist(),
+            'yty': float(yty), 'num_obs': int(num_obs)}
+
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
 
-    v = ss5 / ss4
+
+def read_stats(path):
+    """Memory-map sufficient statistics stored by write_stats."""
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+
+    rows = [np.memmap(_stats_filename(path, field), dtype=float, mode='r',
+                      shape=tuple(meta['shapes'][field]))
+            for field in _STATS_FIELDS]
+
+    return SufficientStats(*rows, np.array(meta['XtX']),
+                           np.array(meta['Xty']), meta['yty'],
+                           meta['num_obs'])
+
+
+def _stats_chunks(dataset):
+    """Compute the statistics of consecutive chunks of subjects.
+
+    The per-subject fields of each chunk hold its own subjects, and the
+    totals are those of the chunk.
+
+    """
+    subjects = iter(dataset)
+
+    for chunk in iter(lambda: list(islice(subjects, _SUBJECTS_PER_CHUNK)),
+                      []):
+        groups = defaultdict(list)
+        for i, (y, X, Z) in enumerate(chunk):
+            groups[len(y)].append(i)
+
+        p1 = chunk[0][1].shape[1]
+        p2 = chunk[0][2].shape[1]
+        ZtZ = np.zeros((len(chunk), p2, p2))
+        ZtX = np.zeros((len(chunk), p2, p1))
+        Zty = np.zeros((len(chunk), p2))
+        XtX = np.zeros((p1, p1))
+        Xty = np.zeros(p1)
+        yty = 0.0
+        num_obs = 0
+
+        for n, index in groups.items():
+            y = np.array([chunk[i][0] for i in index], dtype=float)
+            X = np.array([chunk[i][1] for i in index], dtype=float)
+            Z = np.array([chunk[i][2] for i in index], dtype=float)
+            Zt = Z.transpose(0, 2, 1)
+
+            ZtZ[index] = np.matmul(Zt, Z)
+            ZtX[index] = np.matmul(Zt, X)
+            Zty[index] = np.einsum('ijk,ij->ik', Z, y)
+            XtX += np.einsum('ijk,ijl->kl', X, X)
+            Xty += np.einsum('ijk,ij->k', X, y)
+            yty += np.sum(y**2)
+            num_obs += n * len(index)
+
+        yield SufficientStats(ZtZ, ZtX, Zty, XtX, Xty, yty, num_obs)
+
+
+def _stats_filename(path, field):
+    """The name of the raw file holding a per-subject field."""
+    return os.path.join(path, field + '.f8')
+
+
+def _e_step(stats, lmm):
+    """Compute the posteriors of all subjects and reduce them to sums.
+
+    The posteriors are computed by batched solves over chunks of the
+    stacked statistics of the subjects, and only the sums needed by the
+    M-step (and the log likelihood at the current parameters) are kept.
+
+    """
+    b, v = lmm._coef, lmm._noise_var
+    num_subjects = len(stats.ZtZ)
+    sums = _EStepSums(0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0)
+
+    for start in range(0, num_subjects, _SUBJECTS_PER_CHUNK):
+        rows = slice(start, start + _SUBJECTS_PER_CHUNK)
+        ZtZ, ZtX, Zty = stats.ZtZ[rows], stats.ZtX[rows], stats.Zty[rows]
+
+        Ztr, L, m, S = _batch_posterior(lmm, ZtZ, ZtX, Zty)
+
+        logdet = 2 * np.log(np.diagonal(L, axis1=1, axis2=2)).sum()
+        logdet += len(m) * lmm._ranef_logdet
+
+        sums = _add_sums(sums, _EStepSums(
+            logl=-0.5 * (logdet - np.sum(Ztr * m) / v),
+            ranef_moment=S.sum(axis=0) + np.dot(m.T, m),
+            ZtXm=np.einsum('ijk,ij->k', ZtX, m),
+            mZty=np.sum(m * Zty),
+            mZtZm=np.einsum('ij,ijk,ik->', m, ZtZ, m),
+            trZtZS=np.einsum('ijk,ikj->', ZtZ, S),
+            num_subjects=len(m)))
+
+    rtr = stats.yty - 2 * np.dot(b, stats.Xty) + b @ stats.XtX @ b
+    logdet = stats.num_obs * np.log(2 * np.pi * v)
+    logl = sums.logl - 0.5 * (logdet + rtr / v)
+
+    return sums._replace(logl=logl)
+
+
+def _batch_posterior(lmm, ZtZ, ZtX, Zty):
+    """Compute the posteriors of stacked subjects by batched solves.
+
+    Returns
+    -------
+    The stacked Z'r of the residuals r = y - X beta, the Cholesky
+    factors of the posterior precisions, and the posterior means and
+    covariances.
+
+    """
+    v = lmm._noise_var
+    Ztr = Zty - np.matmul(ZtX, lmm._coef)
+    P = lmm._ranef_prec + ZtZ / v
+    L = np.linalg.cholesky(P)
+    S = np.linalg.inv(P)
+    m = np.einsum('ijk,ik->ij', S, Ztr) / v
+    return Ztr, L, m, S
+
+
+def _m_step(stats, sums):
+    """Compute the parameters maximising the expected log likelihood."""
+    b = la.solve(stats.XtX, stats.Xty - sums.ZtXm)
+    S = sums.ranef_moment / sums.num_subjects
+    v = _expected_rss(stats, sums, b) / stats.num_obs
 
     return b, S, v
 
 
+def _expected_rss(stats, sums, b):
+    """The posterior expectation of the residual sum of squares."""
+    rss = stats.yty - 2 * np.dot(b, stats.Xty) + b @ stats.XtX @ b
+    rss += 2 * np.dot(b, sums.ZtXm) - 2 * sums.mZty + sums.mZtZm
+    return rss + sums.trZtZS
+
+
+def _gradient(lmm, stats, sums):
+    """Gradient of the log likelihood with respect to _pack parameters.
+
+    By Fisher's identity the gradient of the log likelihood is the
+    posterior expectation of the gradient of the complete data log
+    likelihood, which depends on the data only through the E-step sums.
+
+    """
+    b, S, v = lmm.param_copy()
+    grad_b = (stats.Xty - stats.XtX @ b - sums.ZtXm) / v
+    grad_logv = (_expected_rss(stats, sums, b) / v - stats.num_obs) / 2
+
+    prec = lmm._ranef_prec
+    grad_S = (prec @ sums.ranef_moment @ prec - sums.num_subjects * prec) / 2
+    L = la.cholesky(S, lower=True)
+    grad_L = 2 * grad_S @ L
+    grad_L[np.diag_indices_from(L)] *= np.diag(L)
+
+    return np.concatenate([grad_b, grad_L[np.tril_indices_from(L)],
+                           [grad_logv]])
+
+
+def _pack(b, S, v):
+    """Map parameters to an unconstrained vector.
+
+    The vector holds beta, the lower triangle of the Cholesky factor
+    of S with the log of its diagonal, and log(v).
+
+    """
+    L = la.cholesky(S, lower=True)
+    L[np.diag_indices_from(L)] = np.log(np.diag(L))
+    return np.concatenate([b, L[np.tril_indices_from(L)], [np.log(v)]])
+
+
+def _unpack(theta, p1, p2):
+    """Map a vector made by _pack back to parameters."""
+    L = np.zeros((p2, p2))
+    L[np.tril_indices(p2)] = theta[p1:-1]
+    L[np.diag_indices(p2)] = np.exp(np.diag(L))
+    return theta[:p1], np.dot(L, L.T), np.exp(theta[-1])
+
+
+class _Monitor:
+    """Iteration control, instrumentation and checkpoints of a fit."""
+
+    def __init__(self, maxiter, tol, callback, checkpoint, checkpoint_every):
+        self.maxiter = maxiter
+        self.iteration = 0
+        self.e_step = None
+        self._tol = tol
+        self._callback = callback
+        self._checkpoint = checkpoint
+        self._checkpoint_every = checkpoint_every
+        self._passes = 0
+        self._history = []
+        self._timers = defaultdict(lambda: {'wall': 0.0, 'cpu': 0.0,
+                                            'calls': 0})
+        self._start = (perf_counter(), process_time())
+        self._params = None
+        self._logl = None
+
+    @contextmanager
+    def timer(self, phase):
+        """Add the wall and CPU time of a block to the timer of a phase."""
+        wall, cpu = perf_counter(), process_time()
+        try:
+            yield
+        finally:
+            timer = self._timers[phase]
+            timer['wall'] += perf_counter() - wall
+            timer['cpu'] += process_time() - cpu
+            timer['calls'] += 1
+
+    def e_step_of(self, lmm):
+        """Run a timed and counted E-step."""
+        with self.timer('e_step'):
+            self._passes += 1
+            return self.e_step(lmm)
+
+    def start(self, lmm):
+        """Run the E-step at the initial parameters."""
+        sums = self.e_step_of(lmm)
+        self._params = lmm.param_copy()
+        self._logl = sums.logl
+        return sums
+
+    def running(self):
+        """Check if another iteration may start."""
+        return self.iteration < self.maxiter
+
+    def record(self, lmm, logl, **extra):
+        """Record an iteration and decide whether to stop.
+
+        Returns
+        -------
+        True if the fit converged or the callback asked to stop.
+
+        """
+        params = lmm.param_copy()
+        delta = (logl - self._logl) / np.abs(self._logl)
+        changes = [np.linalg.norm(np.subtract(new, old))
+                   for new, old in zip(params, self._params)]
+
+        self.iteration += 1
+        self._params = params
+        self._logl = logl
+
+        record = {'iteration': self.iteration, 'logl': float(logl),
+                  'delta': float(delta), 'coef_change': changes[0],
+                  'ranef_cov_change': changes[1],
+                  'noise_var_change': changes[2], 'passes': self._passes,
+                  'wall': perf_counter() - self._start[0],
+                  'cpu': process_time() - self._start[1]}
+        record.update(extra)
+        self._history.append(record)
+
+        msg = 'Iteration={:05d} LL={:20.8f}, dLL={:20.8f}'
+        logging.info(msg.format(self.iteration, logl, delta))
+
+        if self.iteration % self._checkpoint_every == 0:
+            self.save(lmm)
+
+        stop = delta < self._tol
+        if self._callback is not None:
+            with self.timer('callback'):
+                stop = bool(self._callback(record, lmm)) or stop
+
+        return stop
+
+    def save(self, lmm):
+        """Write the parameters and iteration state to the checkpoint."""
+        if self._checkpoint is None:
+            return
+
+        with self.timer('checkpoint'):
+            coef, ranef_cov, noise_var = lmm.param_copy()
+            logl = np.nan if self._logl is None else self._logl
+            partial_name = self._checkpoint + '.partial'
+            with open(partial_name, 'wb') as f:
+                np.savez(f, coef=coef, ranef_cov=ranef_cov,
+                         noise_var=noise_var, iteration=self.iteration,
+                         logl=logl)
+            os.replace(partial_name, self._checkpoint)
+
+    def info(self, method):
+        """Summarise the fit for full_output."""
+        return {'method': method, 'iterations': self.iteration,
+                'passes': self._passes, 'logl': float(self._logl),
+                'history': self._history, 'timers': dict(self._timers)}
+
+
+class _StopFit(Exception):
+    """Raised to stop an optimiser that has no other way to be stopped."""
+
+
+class _ShardedEStep:
+    """An E-step computed by worker processes that each hold a shard.
+
+    The workers are started once and each computes the statistics of
+    its shard (or is given rows of precomputed statistics). Calling
+    the object with a model sends the parameters to every worker and
+    sums the E-step results of the shards, so the data crossing
+    process boundaries per iteration does not grow with the number of
+    subjects.
+
+    An exception raised in a worker is sent back and raised again by
+    the call (once every worker has replied), and the worker goes on
+    serving, so callers can handle it as if the E-step ran in-process.
+
+    """
+
+    def __init__(self, dataset, processes):
+        if isinstance(dataset, SufficientStats):
+            num_subjects = len(dataset.ZtZ)
+        else:
+            num_subjects = len(dataset)
+
+        shards = np.array_split(np.arange(num_subjects), processes)
+        self._connections = []
+        self._workers = []
+
+        for index in shards:
+            if not len(index):
+                continue
+            parent, child = Pipe()
+            if isinstance(dataset, SufficientStats):
+                shard = _stats_rows(dataset, index, not self._workers)
+            else:
+                shard = [dataset[i] for i in index]
+            worker = Process(target=_shard_worker, args=(shard, child),
+                             daemon=True)
+            worker.start()
+            child.close()
+            self._connections.append(parent)
+            self._workers.append(worker)
+
+        try:
+            totals = self._receive()
+        except BaseException:
+            self.close()
+            raise
+
+        self.stats = SufficientStats(
+            None, None, None,
+            sum(t.XtX for t in totals), sum(t.Xty for t in totals),
+            sum(t.yty for t in totals), sum(t.num_obs for t in totals))
+
+    def __call__(self, lmm):
+        params = lmm.param_copy()
+        for connection in self._connections:
+            connection.send(params)
+        return reduce(_add_sums, self._receive())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop the worker processes (ignoring any that already died)."""
+        for connection in self._connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+            connection.close()
+        for worker in self._workers:
+            worker.join()
+        self._connections = []
+        self._workers = []
+
+    def _receive(self):
+        """Receive one reply from every worker, raising any exception.
+
+        Every connection is drained first so that the replies of the
+        next call are not mixed up with those of this one.
+
+        """
+        replies = []
+        for connection, worker in zip(self._connections, self._workers):
+            try:
+                replies.append(connection.recv())
+            except EOFError:
+                replies.append(RuntimeError(
+                    'LMM worker {} exited with code {}.'.format(
+                        worker.pid, worker.exitcode)))
+
+        for reply in replies:
+            if isinstance(reply, BaseException):
+                raise reply
+
+        return replies
+
+
+def _shard_worker(dataset, connection):
+    """Serve E-steps of one shard until sent None.
+
+    Exceptions are sent back in place of results.
+
+    """
+    try:
+        if isinstance(dataset, SufficientStats):
+            stats = dataset
+        else:
+            stats = sufficient_stats(dataset)
+        connection.send(stats._replace(ZtZ=None, ZtX=None, Zty=None))
+    except Exception as e:
+        connection.send(e)
+        connection.close()
+        return
+
+    lmm = LinearMixedModel(stats.XtX.shape[0], stats.ZtZ.shape[1])
+
+    for params in iter(connection.recv, None):
+        try:
+            lmm.set_params(*params)
+            reply = _e_step(stats, lmm)
+        except Exception as e:
+            reply = e
+        connection.send(reply)
+
+    connection.close()
+
+
+def _stats_rows(stats, index, with_totals):
+    """The statistics of a contiguous range of subjects.
+
+    The totals cannot be split by subject, so they are either kept or
+    replaced by zeros; the E-step sums of ranges of which exactly one
+    keeps the totals add up to those of all the subjects.
+
+    """
+    rows = slice(index[0], index[-1] + 1)
+    shard = stats._replace(ZtZ=stats.ZtZ[rows], ZtX=stats.ZtX[rows],
+                           Zty=stats.Zty[rows])
+    if with_totals:
+        return shard
+    return shard._replace(XtX=np.zeros_like(stats.XtX),
+                          Xty=np.zeros_like(stats.Xty), yty=0.0, num_obs=0)
+
+
+def _add_sums(a, b):
+    """Combine the E-step sums of two sets of subjects."""
+    return _EStepSums(*(x + y for x, y in zip(a, b)))
+
+
 if __name__ == '__main__':
     import pandas as pd
     import matplotlib.pyplot as plt
@@ -103,9 +964,10 @@ if __name__ == '__main__':
 
     low, high = 9, 26
     basis = BSplineBasis.uniform(low, high, num_bases=4, degree=2)
+    basis.enable_cache()
     dataset = [(y, basis(x), basis(x)) for x, y in trajectories]
 
-    model = learn_lmm(dataset, maxiter=5000, tol=1e-7)
+    model = learn_lmm(dataset, maxiter=5000, tol=1e-7, method='squarem')
     
     xgrid = np.linspace(low, high, 200)
     Xgrid = basis(xgrid)
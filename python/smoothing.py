@@ -1,22 +1,87 @@
 """Nonparametric regression."""
 
+import warnings
+
+from collections import deque
+from functools import partial
+from multiprocessing import Pool
+from time import perf_counter
+
 import numpy as np
-import scipy.linalg as la
 
-__all__ = ['KernelSmoother',
-           'smooth', 'estimate_bandwidth', 'loo_estimates',
-           'box_kernel', 'gaussian_kernel']
+__all__ = ['KernelSmoother', 'BinnedSmoother', 'OnlineKernelSmoother',
+           'smooth', 'estimate_bandwidth', 'search_bandwidth',
+           'loo_estimates', 'cv_scores',
+           'box_kernel', 'epanechnikov_kernel', 'tricube_kernel',
+           'gaussian_kernel']
+
+
+_DEFAULT_CHUNK_SIZE = 2**22
+"""Default number of kernel weights computed at once by a smoother."""
+
+_GOLDEN_RATIO = (np.sqrt(5) - 1) / 2
+"""Fraction of a bracket kept by each step of golden-section search."""
+
+_CRITERIA = {'loo': 0, 'gcv': 1}
+"""Index of each cross validation criterion in the output of cv_scores."""
+
+_BINS_PER_BANDWIDTH = 20
+"""Default number of grid bins per bandwidth of a binned smoother."""
+
+_MAX_BINS = 2**22
+"""Largest default number of grid bins of a binned smoother."""
+
+_TRUNCATION = 6.0
+"""Support (in bandwidths) of kernels that are not compact when binned."""
 
 
 class KernelSmoother:
-    """Estimate a smooth function given noisy samples."""
+    """Estimate a smooth function given noisy samples.
+
+    The estimate at each input is the intercept of a local polynomial
+    fit by weighted least squares. Inputs are processed in chunks so
+    that no more than about chunk_size kernel weights are held in
+    memory at once.
+
+    There are two evaluation methods. The 'dense' method weighs every
+    training point for every input. The 'window' method works with
+    the compact kernels (box, Epanechnikov and tricube): the training
+    points are sorted once, and the local moment sums of the points
+    within a bandwidth of an input are found by binary search and
+    differences of running sums, so each input costs O(log n). The
+    default 'auto' uses 'window' when the kernel allows it.
+
+    The response y may be a matrix with one column per series observed
+    at the same inputs. The kernel weights and the factorisations of
+    the local moment matrices are then shared by all of the series.
+    The 'window' method keeps running sums for each series, so it
+    works through the series in blocks whose sums fit in chunk_size
+    values.
 
-    def __init__(self, x, y, kernel, bandwidth=1.0, degree=1):
-        self._x = np.array(x)
-        self._y = np.array(y)
+    """
+
+    def __init__(self, x, y, kernel, bandwidth=1.0, degree=1,
+                 chunk_size=_DEFAULT_CHUNK_SIZE, method='auto'):
+        self._x = np.array(x, dtype=float)
+        self._y = np.array(y, dtype=float)
         self._h = bandwidth
         self._d = degree
         self._kernel = kernel
+        self._chunk_size = chunk_size
+
+        if method == 'auto':
+            method = 'window' if kernel in _COMPACT_KERNELS else 'dense'
+
+        if method == 'window':
+            if kernel not in _COMPACT_KERNELS:
+                raise ValueError('The window method needs a compact kernel.')
+            coefs = _COMPACT_KERNELS[kernel]
+            self._window = _SortedWindow(self._x, self._y, coefs,
+                                         bandwidth, degree)
+        elif method == 'dense':
+            self._window = None
+        else:
+            raise ValueError('Unknown method {!r}.'.format(method))
 
     @property
     def bandwidth(self):
@@ -30,25 +95,351 @@ class KernelSmoother:
 
     def __call__(self, xnew):
         """Compute the value of the estimated function."""
-        xnew = np.atleast_1d(xnew)
-        numx = len(xnew)
-        ynew = np.zeros(numx)
+        xnew = np.atleast_1d(np.asarray(xnew, dtype=float))
+        ynew = np.zeros(xnew.shape + self._y.shape[1:])
+        flat = ynew.reshape(len(xnew), -1)
+        order = self._evaluation_order(xnew)
+
+        for columns in self._series_blocks():
+            for batch in self._batches(len(xnew)):
+                index = order[batch]
+                A, b = self._moments(xnew[index])
+                flat[index, columns] = _solve_intercepts(A, b).reshape(
+                    len(index), -1)
+
+        return ynew
 
-        for i in range(numx):
-            X = self._design(xnew[i])
-            w = self._weights(xnew[i])
-            ynew[i] = _weighted_least_squares(self._y, X, w)[0]
+    def training_fit(self):
+        """Compute the fitted values and leverages of the training data.
+
+        The smoother is linear, yhat = L y, and the leverage of an
+        observation is the diagonal element L[i, i] of the smoother
+        (hat) matrix. Both are computed in one pass.
+
+        Returns
+        -------
+        The fitted values and the leverages at the training inputs.
+
+        """
+        yhat = np.zeros(self._y.shape)
+        flat = yhat.reshape(len(self._x), -1)
+        leverage = np.zeros(len(self._x))
+        order = self._evaluation_order(self._x)
+        self_weight = self._kernel(0.0) / self._h
+
+        for columns in self._series_blocks():
+            for batch in self._batches(len(self._x)):
+                index = order[batch]
+                A, b = self._moments(self._x[index])
+                e1 = np.zeros(A.shape[:2] + (1,))
+                e1[:, 0] = 1.0
+                rows = np.linalg.solve(A, e1)[..., 0]
+                fit = np.einsum('ip,ip...->i...', rows, b)
+                flat[index, columns] = fit.reshape(len(index), -1)
+                leverage[index] = self_weight * rows[:, 0]
+
+        return yhat, leverage
+
+    def _evaluation_order(self, xnew):
+        """Order the inputs for evaluation (sorted for the window method)."""
+        if self._window is None:
+            return np.arange(len(xnew))
+        return np.argsort(xnew, kind='mergesort')
+
+    def _series_blocks(self):
+        """Iterate over blocks of the series (columns of y).
+
+        For the window method, the running sums of each block are
+        built before it is yielded. When one block holds all of the
+        series, its sums are built once and kept between calls.
+
+        """
+        if self._window is None:
+            yield slice(None)
+            return
+
+        num_series = self._window.num_series
+        size = max(self._chunk_size // self._window.cost_per_series, 1)
+        for start in range(0, num_series, size):
+            columns = slice(start, start + size)
+            self._window.select_series(columns)
+            yield columns
+
+    def _batches(self, numx):
+        """Split the indices of the inputs into chunks."""
+        if self._window is None:
+            cost = len(self._x)
+        else:
+            cost = self._window.cost
+
+        size = max(self._chunk_size // max(cost, 1), 1)
+        return [slice(i, i + size) for i in range(0, numx, size)]
+
+    def _moments(self, xnew):
+        """Compute the local normal equations for a batch of inputs.
+
+        Returns
+        -------
+        The moment matrices X'WX stacked in an array of shape
+        (len(xnew), degree + 1, degree + 1) and X'Wy stacked in an
+        array of shape (len(xnew), degree + 1) + y.shape[1:].
+
+        """
+        if self._window is not None:
+            return self._window.moments(xnew)
+
+        return _dense_moments(self._x, self._y, xnew, self._kernel,
+                              self._h, self._d)
+
+
+class OnlineKernelSmoother:
+    """Maintain a kernel smooth of a stream of observations on a grid.
+
+    The local normal equations of every grid point are kept as running
+    sums, so appending m observations costs O(len(xgrid) * m) and
+    evaluating the smooth costs O(len(xgrid)), however many
+    observations have been seen.
+
+    With a window, observations with x more than window below the
+    largest x seen so far are expired by subtracting their terms from
+    the sums. Expiry assumes that observations arrive in order of x,
+    as they do when x is a timestamp.
+
+    """
+
+    def __init__(self, xgrid, kernel, bandwidth=1.0, degree=1, window=None):
+        self._grid = np.atleast_1d(np.array(xgrid, dtype=float))
+        self._h = bandwidth
+        self._d = degree
+        self._kernel = kernel
+        self._window = window
+        self._chunks = deque()
+        self._latest = -np.inf
+        self._A = None
+        self._b = None
+        self._counts = np.zeros(len(self._grid), dtype=int)
+
+    @property
+    def bandwidth(self):
+        """The smoothing bandwidth of the estimator."""
+        return self._h
+
+    @property
+    def degree(self):
+        """The degree of the local polynomials."""
+        return self._d
+
+    @property
+    def grid(self):
+        """The inputs at which the function is estimated."""
+        return self._grid
+
+    def __len__(self):
+        return sum(len(x) for x, _ in self._chunks)
+
+    def __call__(self):
+        """Compute the estimated function on the grid.
+
+        Grid points with no more than degree observations within their
+        window are NaN. The observations are counted exactly, so the
+        rounding error left in the sums by expiry never counts as data.
+
+        """
+        if self._A is None:
+            return np.full(len(self._grid), np.nan)
+        return _solve_intercepts_where_defined(self._A, self._b,
+                                               self._counts > self._d)
+
+    def append(self, x, y):
+        """Add new observations and expire old ones."""
+        x = np.atleast_1d(np.array(x, dtype=float))
+        y = np.array(y, dtype=float).reshape(x.shape + np.shape(y)[1:])
+        if not len(x):
+            return
+
+        self._add(x, y, 1.0)
+        self._chunks.append((x, y))
+        self._latest = max(self._latest, x.max())
+
+        if self._window is not None:
+            self._expire(self._latest - self._window)
+
+    def refresh(self):
+        """Recompute the sums from the retained observations.
+
+        Adding and subtracting terms accumulates rounding error over a
+        long stream; refreshing now and then resets it.
+
+        """
+        self._A = self._b = None
+        self._counts[:] = 0
+        for x, y in self._chunks:
+            self._add(x, y, 1.0)
+
+    def _expire(self, cutoff):
+        """Remove the observations with x below a cutoff."""
+        while self._chunks:
+            x, y = self._chunks[0]
+            expired = x < cutoff
+            if not expired.any():
+                break
+
+            self._add(x[expired], y[expired], -1.0)
+            self._chunks.popleft()
+            if not expired.all():
+                self._chunks.appendleft((x[~expired], y[~expired]))
+                break
+
+    def _add(self, x, y, sign):
+        """Add (or subtract) the terms of observations to the sums."""
+        A, b = _dense_moments(x, y, self._grid, self._kernel, self._h, self._d)
+        if self._A is None:
+            self._A, self._b = np.zeros_like(A), np.zeros_like(b)
+        self._A += sign * A
+        self._b += sign * b
+
+        u = (x[None, :] - self._grid[:, None]) / self._h
+        self._counts += int(sign) * np.count_nonzero(self._kernel(u), axis=1)
+
+
+class BinnedSmoother:
+    """Approximate a KernelSmoother using a regular grid.
+
+    The data are linearly binned onto a grid of num_bins points and the
+    local moment sums at every grid point are computed at once by FFT
+    convolution of the binned counts and responses with the discretised
+    kernel. The local polynomial fits at the grid points are then
+    linearly interpolated to the inputs. Smoothing costs
+    O(n + num_bins log num_bins) whatever the bandwidth.
+
+    Accuracy
+    --------
+    With grid spacing delta, linear binning moves each observation's
+    contribution to the moment sums by at most delta**2 / 8 times the
+    largest second derivative of K(u) u**p / h, and the final linear
+    interpolation adds at most delta**2 / 8 times the largest second
+    derivative of the estimate. For smooth kernels the relative error
+    is therefore O((delta / h)**2); the default of 20 bins per
+    bandwidth typically keeps it near 1e-3 of the scale of y. The box
+    kernel is discontinuous, so its error is O(delta / h) instead.
+    Kernels without compact support are truncated at 6 bandwidths.
+
+    The default grid has at most 2**22 points. If the data span more
+    than about 2e5 bandwidths the spacing is coarser than 20 bins per
+    bandwidth and the error grows accordingly, so a RuntimeWarning is
+    issued; pass num_bins or smooth pieces of the data separately.
+
+    Grid points with fewer than degree + 1 occupied bins within their
+    window have no local fit and are set to NaN, as are inputs
+    interpolated from them. The grid
+    spans [min(x), max(x)] and the estimate is NaN outside that range
+    rather than extrapolated. If all of x are equal the grid is that
+    single point.
+
+    """
+
+    def __init__(self, x, y, kernel, bandwidth=1.0, degree=1, num_bins=None):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        low, high = x.min(), x.max()
+
+        if high == low:
+            num_bins = 1
+        elif num_bins is None:
+            num_bins = int(np.ceil((high - low) / bandwidth
+                                   * _BINS_PER_BANDWIDTH)) + 1
+            if num_bins > _MAX_BINS:
+                msg = ('The grid is capped at {} bins, only {:.2g} per '
+                       'bandwidth; the binned estimate may be inaccurate.')
+                bins_per_bandwidth = _MAX_BINS * bandwidth / (high - low)
+                warnings.warn(msg.format(_MAX_BINS, bins_per_bandwidth),
+                              RuntimeWarning)
+            num_bins = min(max(num_bins, 2), _MAX_BINS)
+        elif num_bins < 2:
+            raise ValueError('A grid spanning the data needs two bins.')
+
+        self._grid = np.linspace(low, high, num_bins)
+        self._h = bandwidth
+        self._d = degree
+        self._kernel = kernel
 
+        if num_bins == 1:
+            delta = bandwidth
+            counts, sums = np.array([len(x)], float), np.array([y.sum()])
+        else:
+            delta = self._grid[1] - self._grid[0]
+            counts, sums = _linear_bins(x, y, low, delta, num_bins)
+        A, b, num_occupied = self._moments(counts, sums, delta)
+        self._fit = _solve_intercepts_where_defined(A, b,
+                                                    num_occupied > degree)
+
+    @property
+    def bandwidth(self):
+        """The smoothing bandwidth of the estimator."""
+        return self._h
+
+    @property
+    def degree(self):
+        """The degree of the local polynomials."""
+        return self._d
+
+    @property
+    def grid(self):
+        """The grid points on which the local polynomials are fit."""
+        return self._grid
+
+    def __call__(self, xnew):
+        """Compute the value of the estimated function."""
+        xnew = np.atleast_1d(np.asarray(xnew, dtype=float))
+        grid = self._grid
+        inside = (xnew >= grid[0]) & (xnew <= grid[-1])
+        ynew = np.full(xnew.shape, np.nan)
+
+        if len(grid) == 1:
+            ynew[inside] = self._fit[0]
+            return ynew
+
+        position = (xnew[inside] - grid[0]) / (grid[1] - grid[0])
+        left = np.minimum(position.astype(int), len(grid) - 2)
+        right_share = position - left
+        ynew[inside] = ((1 - right_share) * self._fit[left] +
+                        right_share * self._fit[left + 1])
         return ynew
 
-    def _design(self, x):
-        """Compute the centered polynomial design matrix for an input."""
-        return _polynomial(self._x - x, self._d)
+    def _moments(self, counts, sums, delta):
+        """Compute the local normal equations at every grid point.
+
+        Returns
+        -------
+        The moment matrices and right-hand sides as for KernelSmoother,
+        and the number of occupied bins with a positive kernel weight
+        at each grid point. The count is exact, unlike the moments,
+        which carry round-off from the FFT even where the count is zero.
+
+        """
+        from scipy.signal import fftconvolve
+
+        support = 1.0 if self._kernel in _COMPACT_KERNELS else _TRUNCATION
+        width = min(int(np.ceil(support * self._h / delta)), len(counts) - 1)
+        dx = np.arange(-width, width + 1) * delta
+        w = self._kernel(dx / self._h) / self._h
 
-    def _weights(self, x):
-        """Compute the weights of the training data for an input."""
-        z = (self._x - x) / self._h
-        return self._kernel(z) / self._h
+        reach = np.max(np.abs(np.flatnonzero(w) - width), initial=0)
+        occupied = np.r_[0, np.cumsum(counts > 0)]
+        index = np.arange(len(counts))
+        num_occupied = (occupied[np.minimum(index + reach + 1, len(counts))] -
+                        occupied[np.maximum(index - reach, 0)])
+
+        S = np.empty((len(counts), 2 * self._d + 1))
+        b = np.empty((len(counts), self._d + 1))
+
+        for p in range(2 * self._d + 1):
+            taps = (w * dx**p)[::-1]
+            S[:, p] = fftconvolve(counts, taps, mode='same')
+            if p <= self._d:
+                b[:, p] = fftconvolve(sums, taps, mode='same')
+
+        return S[:, _hankel_indices(self._d)], b, num_occupied
 
 
 def smooth(x, y, xnew, kernel, bandwidth, degree):
@@ -57,7 +448,7 @@ def smooth(x, y, xnew, kernel, bandwidth, degree):
     Parameters
     ----------
     x : Locations of observed measurements.
-    y : Values of observed measurements.
+    y : Values of observed measurements (one column per series if 2D).
     xnew : Locations of estimated function values.
     kernel : Function to compute weights based on distance.
     bandwidth : Controls the flexibility of the estimate.
@@ -72,8 +463,8 @@ def smooth(x, y, xnew, kernel, bandwidth, degree):
     return yhat(xnew)
 
 
-def estimate_bandwidth(x, y, kernel, bandwidths, degree):
-    """Choose the best bandwidth using LOO cross validation.
+def estimate_bandwidth(x, y, kernel, bandwidths, degree, criterion='loo'):
+    """Choose the best bandwidth using cross validation.
 
     Parameters
     ----------
@@ -82,40 +473,157 @@ def estimate_bandwidth(x, y, kernel, bandwidths, degree):
     kernel : Function to compute weights based on distance.
     bandwidths : The bandwidth options.
     degree : The degree of the local polynomials.
+    criterion : Either 'loo' (leave-one-out) or 'gcv' (generalized).
 
     Returns
     -------
-    The bandwidth minimizing the LOO cross validation mean squared error.
+    The bandwidth minimizing the cross validation mean squared error.
 
     """
-    mse = np.zeros(len(bandwidths))
+    column = _CRITERIA[criterion]
+    scores = np.zeros(len(bandwidths))
 
     for i, bandwidth in enumerate(bandwidths):
-        yhat = loo_estimates(x, y, kernel, bandwidth, degree)
-        mse[i] = np.mean((y - yhat)**2)
+        scores[i] = cv_scores(x, y, kernel, bandwidth, degree)[column]
 
-    return bandwidths[np.argmin(mse)]
+    return bandwidths[np.argmin(scores)]
 
 
-def loo_estimates(x, y, kernel, bandwidth, degree):
-    """Compute leave-one-out estimates of the data.
+def search_bandwidth(x, y, kernel, bandwidths, degree, criterion='loo',
+                     processes=1, refine=False, tol=1e-2):
+    """Search for the best bandwidth and report the cross validation curve.
+
+    The candidate bandwidths are scored in parallel. With refine, the
+    candidates are taken as a coarse grid (e.g. from numpy.geomspace)
+    and the minimum is then refined by golden-section search on the
+    log bandwidth between the neighbours of the best candidate.
 
     Parameters
     ----------
     x : Locations of observed measurements.
     y : Values of observed measurements.
     kernel : Function to compute weights based on distance.
+    bandwidths : The bandwidth options (or the coarse grid).
+    degree : The degree of the local polynomials.
+    criterion : Either 'loo' (leave-one-out) or 'gcv' (generalized).
+    processes : Number of worker processes (None for one per CPU).
+    refine : Refine the best candidate by golden-section search.
+    tol : Width of the final bracket on the log bandwidth.
+
+    Returns
+    -------
+    A dictionary with the best 'bandwidth' and its 'score', and every
+    evaluated bandwidth in 'bandwidths' (sorted) with its 'loo' and
+    'gcv' scores and the seconds spent on it in 'times'. The total
+    wall-clock time is in 'elapsed'.
+
+    """
+    start = perf_counter()
+    column = _CRITERIA[criterion]
+    score = partial(_timed_cv_scores, x, y, kernel, degree=degree)
+
+    bandwidths = [float(h) for h in bandwidths]
+    if processes == 1:
+        results = [score(h) for h in bandwidths]
+    else:
+        with Pool(processes) as pool:
+            results = pool.map(score, bandwidths)
+
+    curve = dict(zip(bandwidths, results))
+
+    if refine and len(bandwidths) > 1:
+        grid = sorted(curve)
+        best = min(range(len(grid)), key=lambda i: curve[grid[i]][column])
+        lo = np.log(grid[max(best - 1, 0)])
+        hi = np.log(grid[min(best + 1, len(grid) - 1)])
+
+        def objective(log_h):
+            """Score a bandwidth, remembering the result."""
+            h = float(np.exp(log_h))
+            if h not in curve:
+                curve[h] = score(h)
+            return curve[h][column]
+
+        _golden_section(objective, lo, hi, tol)
+
+    grid = sorted(curve)
+    table = np.array([curve[h] for h in grid])
+    best = int(np.argmin(table[:, column]))
+
+    return {
+        'bandwidth': grid[best],
+        'score': table[best, column],
+        'bandwidths': np.array(grid),
+        'loo': table[:, 0],
+        'gcv': table[:, 1],
+        'times': table[:, 2],
+        'elapsed': perf_counter() - start,
+    }
+
+
+def cv_scores(x, y, kernel, bandwidth, degree):
+    """Compute the LOO and GCV mean squared errors of a smoother.
+
+    Parameters
+    ----------
+    x : Locations of observed measurements.
+    y : Values of observed measurements (one column per series if 2D).
+    kernel : Function to compute weights based on distance.
+    bandwidth : Controls the flexibility of the estimate.
+    degree : The degree of the local polynomials.
+
+    Returns
+    -------
+    The leave-one-out mean squared error and the generalized cross
+    validation score mean((y - yhat)**2) / (1 - trace(L) / n)**2.
+
+    """
+    y = np.asarray(y, dtype=float)
+    yhat, leverage = KernelSmoother(x, y, kernel, bandwidth,
+                                    degree).training_fit()
+    leverage = _per_observation(leverage, y)
+
+    resid = y - yhat
+    loo = np.mean((resid / (1 - leverage))**2)
+    gcv = np.mean(resid**2) / (1 - np.mean(leverage))**2
+
+    return loo, gcv
+
+
+def loo_estimates(x, y, kernel, bandwidth, degree, method='hat'):
+    """Compute leave-one-out estimates of the data.
+
+    Parameters
+    ----------
+    x : Locations of observed measurements.
+    y : Values of observed measurements (one column per series if 2D).
+    kernel : Function to compute weights based on distance.
     bandwidth : Controls the flexibility of the estimate.
     degree : The degree of the local polynomials.
+    method : Either 'hat' to use the closed form yhat_i - L[i, i] y_i
+        divided by (1 - L[i, i]), or 'refit' to smooth without each
+        observation in turn.
 
     Returns
     -------
     Estimates of each observation computed using all other observations.
 
     """
+    if method not in ('hat', 'refit'):
+        raise ValueError('Unknown method {!r}.'.format(method))
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    if method == 'hat':
+        yhat, leverage = KernelSmoother(x, y, kernel, bandwidth,
+                                        degree).training_fit()
+        leverage = _per_observation(leverage, y)
+        return (yhat - leverage * y) / (1 - leverage)
+
     numx = len(x)
     mask = np.arange(numx)
-    yhat = np.zeros(numx)
+    yhat = np.zeros(y.shape)
 
     def smoother(x, y, xnew):
         """Smooth using the enclosed parameters."""
@@ -123,30 +631,307 @@ def loo_estimates(x, y, kernel, bandwidth, degree):
 
     for i in range(numx):
         holdout = mask == i
-        yhat[i] = smoother(x[~holdout], y[~holdout], x[holdout])
+        yhat[i] = smoother(x[~holdout], y[~holdout], x[holdout])[0]
 
     return yhat
 
 
+def _per_observation(values, y):
+    """Shape one value per observation to broadcast against y."""
+    return values.reshape(values.shape + (1,) * (y.ndim - 1))
+
+
+def _timed_cv_scores(x, y, kernel, bandwidth, degree):
+    """Compute cv_scores and the seconds it took."""
+    start = perf_counter()
+    loo, gcv = cv_scores(x, y, kernel, bandwidth, degree)
+    return loo, gcv, perf_counter() - start
+
+
+def _golden_section(f, lo, hi, tol):
+    """Minimise a unimodal function on [lo, hi] by golden-section search."""
+    a = hi - _GOLDEN_RATIO * (hi - lo)
+    b = lo + _GOLDEN_RATIO * (hi - lo)
+    fa, fb = f(a), f(b)
+
+    while hi - lo > tol:
+        if fa < fb:
+            hi, b, fb = b, a, fa
+            a = hi - _GOLDEN_RATIO * (hi - lo)
+            fa = f(a)
+        else:
+            lo, a, fa = a, b, fb
+            b = lo + _GOLDEN_RATIO * (hi - lo)
+            fb = f(b)
+
+    return (a, fa) if fa < fb else (b, fb)
+
+
 def box_kernel(x):
     """Compute the box kernel."""
     return np.where(np.abs(x) < 1.0, 0.5, 0.0)
 
 
+def epanechnikov_kernel(x):
+    """Compute the Epanechnikov kernel."""
+    return np.where(np.abs(x) < 1.0, 0.75 * (1.0 - x**2), 0.0)
+
+
+def tricube_kernel(x):
+    """Compute the tricube kernel."""
+    return np.where(np.abs(x) < 1.0, 70 / 81 * (1.0 - np.abs(x)**3)**3, 0.0)
+
+
 def gaussian_kernel(x):
     """Compute the Gaussian kernel."""
     return np.exp(-x**2)
 
 
-def _weighted_least_squares(y, X, w):
-    """Compute the weighted least squares coefficient estimate."""
-    W = np.diag(w)
-    A = X.T @ W @ X
-    b = X.T @ W @ y
-    return la.solve(A, b)
+_COMPACT_KERNELS = {
+    box_kernel: [0.5],
+    epanechnikov_kernel: [0.75, 0.0, -0.75],
+    tricube_kernel: np.array([1, 0, 0, -3, 0, 0, 3, 0, 0, -1]) * 70 / 81,
+}
+"""Coefficients of the compact kernels as polynomials in |x| on (-1, 1)."""
+
+
+class _SortedWindow:
+    """Local moment sums of a compact polynomial kernel.
+
+    The training inputs are sorted and split into blocks one bandwidth
+    wide. Each input is measured from the centre of its block in units
+    of the bandwidth, which keeps the running sums of its powers well
+    conditioned. The window of an input x0 is found by binary search
+    and cut at x0 and at block boundaries into at most five pieces;
+    on each piece the kernel is a polynomial in (x - x0), so its
+    moment sums follow from differences of the running sums and the
+    binomial theorem. Each input costs O(log n), however many training
+    points fall in its window.
+
+    """
+
+    _NUM_PIECES = 5
+
+    def __init__(self, x, y, coefs, bandwidth, degree):
+        order = np.argsort(x, kind='mergesort')
+        self._x = x[order]
+        self._coefs = np.asarray(coefs, dtype=float)
+        self._h = bandwidth
+        self._d = degree
+
+        self._origin = self._x[0]
+        scaled = (self._x - self._origin) / bandwidth
+        self._blocks = np.floor(scaled).astype(int)
+
+        num_powers = len(self._coefs) + 2 * degree
+        offsets = scaled - self._blocks - 0.5
+        powers = offsets[None, :]**np.arange(num_powers)[:, None]
+        self._sums = _running_sums(powers)
+        self._ypowers = powers[:len(self._coefs) + degree]
+        self._order = order
+        self._y = y.reshape(len(x), -1)
+        self._ysums = None
+        self._columns = None
+
+    @property
+    def num_series(self):
+        """The number of series (columns of y)."""
+        return self._y.shape[1]
+
+    @property
+    def cost_per_series(self):
+        """The number of running sums kept per series."""
+        return self._ypowers.size + len(self._ypowers)
+
+    @property
+    def cost(self):
+        """The number of values computed per input (for chunking)."""
+        num_series = self._ysums.shape[2]
+        num_powers = len(self._sums)
+        return self._NUM_PIECES * num_powers * (num_powers + num_series)
+
+    def select_series(self, columns):
+        """Build the running sums of a block of the series."""
+        columns = slice(*columns.indices(self.num_series))
+        if columns == self._columns:
+            return
+
+        self._ysums = self._columns = None
+        y = self._y[self._order, columns]
+        shape = self._ypowers.shape + y.shape[1:]
+        self._ysums = np.zeros((shape[0], shape[1] + 1) + shape[2:])
+        terms = self._ysums[:, 1:]
+        np.multiply(self._ypowers[:, :, None], y[None], out=terms)
+        np.cumsum(terms, axis=1, out=terms)
+        self._columns = columns
+
+    def moments(self, xnew):
+        """Compute the local normal equations for a batch of inputs."""
+        h = self._h
+        lo, hi = self._window_bounds(xnew)
+        mid = np.searchsorted(self._x, xnew, 'left')
+
+        last = len(self._x) - 1
+        first_block = self._blocks[np.minimum(lo, last)]
+        cuts = [lo, mid, hi]
+        cuts += [np.searchsorted(self._blocks, first_block + k)
+                 for k in (1, 2, 3)]
+        cuts = np.sort(np.clip(np.stack(cuts, axis=1),
+                               lo[:, None], hi[:, None]), axis=1)
+        starts, stops = cuts[:, :-1], cuts[:, 1:]
+
+        blocks = self._blocks[np.minimum(starts, last)]
+        shifts = (xnew[:, None] - self._origin) / h - blocks - 0.5
+        signs = np.where(starts >= mid[:, None], 1.0, -1.0)
+
+        S = self._kernel_moments(self._sums, starts, stops, shifts, signs,
+                                 2 * self._d + 1)
+        b = self._kernel_moments(self._ysums, starts, stops, shifts, signs,
+                                 self._d + 1)
+
+        scale = h**(np.arange(2 * self._d + 1) - 1.0)
+        S *= scale
+        b *= scale[:self._d + 1].reshape((-1,) + (1,) * (b.ndim - 2))
+
+        return S[:, _hankel_indices(self._d)], b
+
+    def _window_bounds(self, xnew):
+        """Find the training points with |(x - x0) / h| < 1.
+
+        The bounds found by binary search on x0 - h and x0 + h can
+        differ by rounding from the comparison the kernels make, which
+        matters for the discontinuous box kernel, so they are moved
+        over runs of equal inputs until they agree with it.
+
+        """
+        x, h = self._x, self._h
+        lo = np.searchsorted(x, xnew - h, 'right')
+        hi = np.searchsorted(x, xnew + h, 'left')
+
+        lo = _first_where(x, lo, lambda v: (v - xnew) / h > -1.0)
+        hi = _first_where(x, hi, lambda v: ~((v - xnew) / h < 1.0))
+        return lo, hi
+
+    def _kernel_moments(self, sums, starts, stops, shifts, signs, num):
+        """Sum kernel weights times powers of (x - x0) over the pieces.
+
+        The sum over a piece of the power (x - x0)**r is expanded as
+        (v - t)**r in the block offsets v and the shift t of x0, and
+        the kernel is sum_a c_a |u|**a = sum_a c_a (s u)**a where s is
+        the sign of u on the piece. The binomial expansion is applied
+        in place as a product of bidiagonal factors.
+
+        """
+        M = sums[:, stops] - sums[:, starts]
+        series = (1,) * (M.ndim - 3)
+        shifts = shifts.reshape(shifts.shape + series)
+        signs = signs.reshape(signs.shape + series)
+
+        for k in range(len(M) - 1):
+            for r in range(len(M) - 1, k, -1):
+                M[r] -= shifts * M[r - 1]
+
+        moments = np.zeros((num, len(starts)) + M.shape[3:])
+        for a, c in enumerate(self._coefs):
+            if c != 0:
+                weighted = c * M[a:a + num]
+                if a % 2:
+                    weighted *= signs
+                moments += weighted.sum(axis=2)
+
+        return np.moveaxis(moments, 0, 1)
+
+
+def _running_sums(values):
+    """Prefix sums along the second axis, starting with zero."""
+    shape = list(values.shape)
+    shape[1] += 1
+    sums = np.zeros(shape)
+    np.cumsum(values, axis=1, out=sums[:, 1:])
+    return sums
+
+
+def _first_where(x, index, predicate):
+    """Move indices into sorted x to where a monotone predicate turns on.
+
+    The predicate maps an array of one value of x per index to an array
+    of booleans that is false and then true along x. Each index is moved
+    over runs of equal values until x[index] is the first that holds.
+
+    """
+    index = np.array(index)
+    last = len(x) - 1
+
+    while True:
+        after = x[np.minimum(index, last)]
+        before = x[np.maximum(index - 1, 0)]
+        forward = (index <= last) & ~predicate(after)
+        backward = (index > 0) & predicate(before)
+        if not (forward.any() or backward.any()):
+            return index
+
+        index[forward] = np.searchsorted(x, after[forward], 'right')
+        index[backward] = np.searchsorted(x, before[backward], 'left')
+
+
+def _linear_bins(x, y, low, delta, num_bins):
+    """Linearly bin the counts and responses onto a regular grid."""
+    position = (x - low) / delta
+    left = np.clip(np.floor(position).astype(int), 0, num_bins - 2)
+    right_share = position - left
+
+    counts = (np.bincount(left, 1 - right_share, num_bins) +
+              np.bincount(left + 1, right_share, num_bins))
+    sums = (np.bincount(left, (1 - right_share) * y, num_bins) +
+            np.bincount(left + 1, right_share * y, num_bins))
+
+    return counts, sums
+
+
+def _solve_intercepts_where_defined(A, b, defined):
+    """Solve a stack of normal equations, with NaN where not defined."""
+    intercepts = np.full(b.shape[:1] + b.shape[2:], np.nan)
+    intercepts[defined] = _solve_intercepts(A[defined], b[defined])
+    return intercepts
+
+
+def _dense_moments(x, y, xnew, kernel, bandwidth, degree):
+    """Compute the local normal equations by weighing every observation.
+
+    Returns
+    -------
+    The moment matrices X'WX stacked in an array of shape
+    (len(xnew), degree + 1, degree + 1) and X'Wy stacked in an array
+    of shape (len(xnew), degree + 1) + y.shape[1:].
+
+    """
+    dx = x[None, :] - xnew[:, None]
+    w = kernel(dx / bandwidth) / bandwidth
+
+    S = np.empty((len(xnew), 2 * degree + 1))
+    b = np.empty((len(xnew), degree + 1) + y.shape[1:])
+
+    for p in range(2 * degree + 1):
+        S[:, p] = w.sum(axis=1)
+        if p <= degree:
+            b[:, p] = w @ y
+        w *= dx
+
+    return S[:, _hankel_indices(degree)], b
+
+
+def _solve_intercepts(A, b):
+    """Solve a stack of normal equations for the intercepts.
+
+    Each matrix is factorised once for all of the columns of b.
+
+    """
+    rhs = b.reshape(b.shape[:2] + (int(np.prod(b.shape[2:])),))
+    intercepts = np.linalg.solve(A, rhs)[:, 0]
+    return intercepts.reshape(b.shape[:1] + b.shape[2:])
 
 
-def _polynomial(x, degree):
-    """Create a polynomial design matrix."""
-    x = np.atleast_1d(x)
-    return np.array([x**p for p in range(degree + 1)]).T
+def _hankel_indices(degree):
+    """Index the moments of a polynomial design into its moment matrix."""
+    powers = np.arange(degree + 1)
+    return powers[:, None] + powers[None, :]
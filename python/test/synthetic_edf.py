@@ -0,0 +1,55 @@
+"""Write small synthetic EDF files for the tests."""
+
+import numpy as np
+
+
+def write_edf(filename, samples_per_record, num_records,
+              seconds_per_record=1, start_date='16.03.04', seed=0):
+    """Write an EDF file of random 16-bit signals.
+
+    Parameters
+    ----------
+    filename : Path of the file to write.
+    samples_per_record : The number of samples of each signal per record.
+    num_records : The number of data records.
+    seconds_per_record : The duration of a record in seconds.
+    start_date : The start date field (dd.mm.yy).
+    seed : Seed of the random samples.
+
+    Returns
+    -------
+    The list of signal labels.
+
+    """
+    rng = np.random.RandomState(seed)
+    num_signals = len(samples_per_record)
+    labels = ['Signal {}'.format(i) for i in range(num_signals)]
+
+    def field(value, width):
+        return str(value).ljust(width)[:width].encode('ascii')
+
+    header = field(0, 8) + field('patient', 80) + field('recording', 80)
+    header += field(start_date, 8) + field('10.11.12', 8)
+    header += field(256 * (num_signals + 1), 8) + field('', 44)
+    header += field(num_records, 8) + field(seconds_per_record, 8)
+    header += field(num_signals, 4)
+
+    signal_fields = [
+        (labels, 16), (['transducer'] * num_signals, 80),
+        (['uV'] * num_signals, 8),
+        ([-100 - i for i in range(num_signals)], 8),
+        ([200 + i for i in range(num_signals)], 8),
+        ([-32768] * num_signals, 8), ([32767] * num_signals, 8),
+        ([''] * num_signals, 80), (samples_per_record, 8),
+        ([''] * num_signals, 32)]
+    for values, width in signal_fields:
+        header += b''.join(field(v, width) for v in values)
+
+    with open(filename, 'wb') as f:
+        f.write(header)
+        for _ in range(num_records):
+            for num_samples in samples_per_record:
+                samples = rng.randint(-32768, 32768, num_samples)
+                f.write(samples.astype('<i2').tobytes())
+
+    return labels
@@ -0,0 +1,132 @@
+"""Test bsplines.py module."""
+
+from importlib import reload
+from time import time
+
+import numpy as np
+import scipy.sparse as sp
+
+import bsplines
+reload(bsplines)
+
+np.random.seed(0)
+
+for degree in [0, 1, 2, 3]:
+    basis = bsplines.BSplineBasis.with_knots([0, 1, 1, 3, 4.5, 7, 10], degree)
+    x = np.r_[np.random.uniform(-1, 11, 1000), 0, 1, 3, 10]
+    w = np.random.uniform(size=len(x))
+
+    dense = basis(x)
+    diff = np.max(np.abs(basis(x, sparse=True).toarray() - dense))
+    print('degree={} max. difference of sparse bases {:.2e}'.format(
+        degree, diff))
+    assert np.allclose(basis(x, sparse=True).toarray(), dense)
+
+    gram = dense.T @ (w[:, None] * dense)
+    assert np.allclose(basis.gram(x, w).toarray(), gram)
+
+n = 1000000
+basis = bsplines.BSplineBasis.uniform(0, 1, 200, 3)
+x = np.random.uniform(size=n)
+
+start = time()
+basis.gram(x, banded=True)
+print('Banded Gram matrix of {} rows in {:.2f}s'.format(n, time() - start))
+
+basis = bsplines.BSplineBasis.uniform(9, 26, 10, 3)
+visits = [np.round(np.random.uniform(9, 26, 5)) for _ in range(1000)]
+
+start = time()
+uncached = [basis(x) for x in visits for _ in range(2)]
+print('Uncached evaluation in {:.3f}s'.format(time() - start))
+
+basis.enable_cache()
+start = time()
+cached = [basis(x) for x in visits for _ in range(2)]
+print('Cached evaluation in {:.3f}s'.format(time() - start))
+print(basis.cache_info())
+
+for B1, B2 in zip(uncached, cached):
+    assert np.allclose(B1, B2)
+
+x = np.concatenate(visits)
+assert np.allclose(basis(x, unique=True), basis(x))
+assert np.allclose(basis(x, sparse=True, unique=True).toarray(), basis(x))
+
+x = np.random.uniform(0, 1, 2000)
+y = np.sin(8 * x) + np.random.normal(scale=0.3, size=len(x))
+w = np.random.uniform(0.5, 2, size=len(x))
+basis = bsplines.BSplineBasis.uniform(0, 1, 40, 3)
+spline = bsplines.PSpline(basis).fit(x, y, w)
+
+B = basis(x)
+A = B.T @ (w[:, None] * B) + spline.lam * bsplines.pspline_penalty(basis, 2)
+assert np.allclose(spline.coef, np.linalg.solve(A, B.T @ (w * y)))
+assert np.allclose(spline(x), B @ spline.coef)
+print('P-spline lambda={:.3g} edf={:.2f}'.format(
+    spline.lam, spline.effective_dof()))
+
+for x in [np.random.uniform(0, 0.9, 300),
+          np.concatenate([np.random.uniform(0, 0.3, 150),
+                          np.random.uniform(0.7, 1, 150)])]:
+    y = np.sin(8 * x) + np.random.normal(scale=0.3, size=len(x))
+    basis = bsplines.BSplineBasis.uniform(0, 1, 30, 3)
+    spline = bsplines.PSpline(basis).fit(x, y)
+
+    B = basis(x)
+    G, P = B.T @ B, bsplines.pspline_penalty(basis, 2)
+    path = spline.path
+    for lam, edf, gcv in zip(path['lambdas'], path['edf'], path['gcv']):
+        H = np.linalg.solve(G + lam * P, G)
+        rss = np.sum((y - B @ np.linalg.solve(G + lam * P, B.T @ y))**2)
+        assert np.isclose(edf, np.trace(H))
+        assert np.isclose(gcv, len(x) * rss / (len(x) - np.trace(H))**2)
+
+x = np.random.uniform(0, 1, n)
+y = np.sin(8 * x) + np.random.normal(scale=0.3, size=n)
+basis = bsplines.BSplineBasis.uniform(0, 1, 200, 3)
+
+start = time()
+spline = bsplines.PSpline(basis).fit(x, y, criterion='reml')
+print('P-spline of {} rows over {} lambdas in {:.2f}s'.format(
+    n, len(spline.path['lambdas']), time() - start))
+
+marginals = [bsplines.BSplineBasis.uniform(0, 1, 12, 3),
+             bsplines.BSplineBasis.uniform(0, 5, 9, 2)]
+basis = bsplines.TensorProductBasis(*marginals)
+x = [np.random.uniform(0, 1, 500), np.random.uniform(0, 5, 500)]
+B1, B2 = (b(xj) for b, xj in zip(marginals, x))
+assert np.allclose(basis(x),
+                   (B1[:, :, None] * B2[:, None, :]).reshape(500, -1))
+
+grids = [np.linspace(0, 1, 40), np.linspace(0, 5, 30)]
+B = np.kron(marginals[0](grids[0]), marginals[1](grids[1]))
+W = np.random.uniform(size=(40, 30))
+Y = np.sin(4 * grids[0])[:, None] * np.cos(grids[1])[None, :]
+Y += np.random.normal(scale=0.2, size=Y.shape)
+assert np.allclose(basis.grid_gram(grids, W), B.T @ (W.ravel()[:, None] * B))
+assert np.allclose(basis.grid_dot_transpose(grids, Y), B.T @ Y.ravel())
+
+P1, P2 = basis.penalties((2, 1))
+assert sp.issparse(P1) and sp.issparse(P2)
+assert np.allclose(P1.toarray(), np.kron(
+    bsplines.pspline_penalty(marginals[0], 2), np.eye(basis.shape[1])))
+assert np.allclose(P2.toarray(), np.kron(
+    np.eye(basis.shape[0]), bsplines.pspline_penalty(marginals[1], 1)))
+assert np.allclose(bsplines.pspline_penalty(basis, (2, 1)).toarray(),
+                   (P1 + P2).toarray())
+
+on_grid = bsplines.PSpline(basis).fit(grids, Y, W, grid=True)
+points = [g.ravel() for g in np.meshgrid(*grids, indexing='ij')]
+scattered = bsplines.PSpline(basis).fit(points, Y.ravel(), W.ravel())
+assert np.allclose(on_grid.coef, scattered.coef)
+assert np.allclose(on_grid(grids, grid=True).ravel(), scattered(points))
+
+basis = bsplines.TensorProductBasis(
+    *[bsplines.BSplineBasis.uniform(0, 1, 12, 3) for _ in range(3)])
+grids = [np.linspace(0, 1, 100)] * 3
+
+start = time()
+bsplines.PSpline(basis).fit(grids, np.random.normal(size=(100,) * 3),
+                            grid=True)
+print('Tensor P-spline of a 100^3 grid in {:.2f}s'.format(time() - start))
@@ -1,12 +1,22 @@
 """Test edf.py module."""
 
-from imp import reload
+import os
+import shutil
+import tempfile
+
+from importlib import reload
 from pprint import pprint
 
+import numpy as np
+
 import edf
 reload(edf)
 
-edf_filename = 'test/sample.edf'
+from synthetic_edf import write_edf
+
+directory = tempfile.mkdtemp()
+edf_filename = os.path.join(directory, 'sample.edf')
+write_edf(edf_filename, [256, 100, 1], num_records=10)
 
 with open(edf_filename, 'rb') as f:
     # header = edf._read_header(f)
@@ -15,3 +25,48 @@ with open(edf_filename, 'rb') as f:
 pprint(header)
 pprint(signals)
 pprint(edf.samples_per_sec(header))
+
+with open(edf_filename, 'rb') as f:
+    lazy_header, lazy_signals = edf.header_and_lazy_signals(f)
+
+    for label, signal in signals.items():
+        assert np.allclose(lazy_signals[label][:], signal)
+
+pprint(lazy_signals)
+
+with open(edf_filename, 'rb') as f:
+    header = edf._read_header(f)
+    seconds = header['seconds_per_record']
+    window = edf.read_seconds(f, header, seconds, 3 * seconds)
+    records = edf.read_records(f, header, 1, 3)
+
+    for label, signal in records.items():
+        assert np.allclose(window[label], signal)
+
+    before = edf.read_seconds(f, header, -seconds / 2, 1.5 * seconds)
+    after = edf.read_seconds(f, header, 0, 1.5 * seconds)
+    for label, signal in after.items():
+        assert np.allclose(before[label], signal)
+
+    for epoch in edf.iter_epochs(f, header, 2 * seconds):
+        pprint(epoch)
+
+    epochs = list(edf.iter_epochs(f, header, seconds))
+    stop = 1000 * len(epochs) * seconds
+    beyond = list(edf.iter_epochs(f, header, seconds, stop=stop))
+    before = list(edf.iter_epochs(f, header, seconds, start=-2 * seconds))
+    assert len(beyond) == len(before) == len(epochs)
+    for epoch, clipped, early in zip(epochs, beyond, before):
+        for label, signal in epoch.items():
+            assert np.allclose(clipped[label], signal)
+            assert np.allclose(early[label], signal)
+
+with open(edf_filename, 'rb') as f:
+    subset = header['label'][:2]
+    header, selected = edf.header_and_signals(f, channels=subset)
+
+    assert list(selected) == subset
+    for label, signal in selected.items():
+        assert np.allclose(signal, signals[label])
+
+shutil.rmtree(directory)
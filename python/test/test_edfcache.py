@@ -0,0 +1,115 @@
+"""Test edfcache.py module."""
+
+import logging
+import os
+import shutil
+import tempfile
+
+from importlib import reload
+
+import numpy as np
+
+import edf
+import edfcache
+reload(edfcache)
+
+from synthetic_edf import write_edf
+
+directory = tempfile.mkdtemp()
+cache_dir = os.path.join(directory, 'cache')
+
+recordings = [('a.edf', [100, 50], '31.01.05'),
+              ('b.edf', [100, 20, 1], '01.02.05'),
+              ('c.edf', [64], '07.08.99')]
+filenames = []
+for seed, (name, samples_per_record, start_date) in enumerate(recordings):
+    filenames.append(os.path.join(directory, name))
+    write_edf(filenames[-1], samples_per_record, num_records=30,
+              start_date=start_date, seed=seed)
+
+entries = edfcache.ingest(filenames[:2], cache_dir, processes=2)
+assert [e['source'] for e in entries] == filenames[:2]
+
+for entry, filename in zip(entries, filenames):
+    with open(filename, 'rb') as f:
+        expected_header, expected = edf.header_and_signals(f)
+
+    header, signals = edfcache.load(cache_dir, entry['name'])
+    assert header['label'] == expected_header['label']
+    assert header['start_date'] == expected_header['start_date']
+    assert np.all(header['samples_per_record'] ==
+                  expected_header['samples_per_record'])
+    for label, signal in signals.items():
+        assert isinstance(signal, np.memmap)
+        assert np.array_equal(signal, expected[label])
+
+    label = header['label'][-1]
+    header, signals = edfcache.load(cache_dir, entry['name'], [label])
+    assert list(signals) == [label]
+
+print('Cached {} recordings'.format(len(entries)))
+
+
+def sources(matches):
+    return [os.path.basename(e['source']) for e in matches]
+
+
+assert sources(edfcache.query(cache_dir)) == ['a.edf', 'b.edf']
+assert sources(edfcache.query(cache_dir, label='Signal 2')) == ['b.edf']
+assert sources(edfcache.query(cache_dir, rate=50)) == ['a.edf']
+assert sources(edfcache.query(cache_dir, label='Signal 1', rate=20)) == [
+    'b.edf']
+assert sources(edfcache.query(cache_dir, label='Signal 0', rate=20)) == []
+
+assert [e['start_date'] for e in entries] == [[2005, 1, 31], [2005, 2, 1]]
+for start_date, expected in [
+        ((2005, 1, 31), ['a.edf']),
+        ((2005, 2, 1), ['b.edf']),
+        (((2005, 1, 1), (2005, 1, 31)), ['a.edf']),
+        (((2005, 1, 15), (2005, 2, 15)), ['a.edf', 'b.edf']),
+        (((2005, 2, 1), (2005, 12, 31)), ['b.edf']),
+        (((2004, 1, 1), (2004, 12, 31)), [])]:
+    assert sources(edfcache.query(cache_dir, start_date=start_date)) == (
+        expected)
+
+header_files = [os.path.join(cache_dir, e['name'], 'header.json')
+                for e in entries]
+mtimes = [os.stat(f).st_mtime_ns for f in header_files]
+edfcache.ingest(filenames[:2], cache_dir, processes=2)
+assert [os.stat(f).st_mtime_ns for f in header_files] == mtimes
+
+write_edf(filenames[0], [100, 50], num_records=40, start_date='31.01.05',
+          seed=10)
+entries = edfcache.ingest(filenames, cache_dir, processes=2)
+assert os.stat(header_files[1]).st_mtime_ns == mtimes[1]
+assert entries[0]['num_records'] == 40
+
+with open(filenames[0], 'rb') as f:
+    expected = edf.header_and_signals(f)[1]
+signals = edfcache.load(cache_dir, entries[0]['name'])[1]
+assert all(np.array_equal(signals[k], v) for k, v in expected.items())
+
+broken = os.path.join(directory, 'broken.edf')
+with open(broken, 'wb') as f:
+    f.write(b'not an EDF header')
+
+warnings = []
+handler = logging.Handler()
+handler.emit = warnings.append
+logging.getLogger().addHandler(handler)
+entries = edfcache.ingest([broken] + filenames[2:], cache_dir, processes=2)
+logging.getLogger().removeHandler(handler)
+
+assert sources(entries) == ['c.edf']
+assert len(warnings) == 1 and broken in warnings[0].getMessage()
+print(warnings[0].getMessage())
+manifest = edfcache.read_manifest(cache_dir)
+assert sources(manifest) == ['a.edf', 'b.edf', 'c.edf']
+assert manifest[0]['num_records'] == 40
+assert manifest[2]['start_date'] == [1999, 8, 7]
+assert sources(edfcache.query(
+    cache_dir, start_date=((1990, 1, 1), (2005, 1, 31)))) == ['a.edf', 'c.edf']
+assert not any(name.endswith('.partial') for name in os.listdir(cache_dir))
+print('Manifest holds {} recordings'.format(len(manifest)))
+
+shutil.rmtree(directory)
@@ -0,0 +1,82 @@
+"""Test edffeatures.py module."""
+
+import os
+import shutil
+import tempfile
+
+from importlib import reload
+
+import numpy as np
+
+import edf
+import edffeatures
+reload(edffeatures)
+
+from synthetic_edf import write_edf
+
+
+def periodogram_power(x, rate, low, high):
+    """Two-sided periodogram power of x at frequencies |f| in [low, high)."""
+    freqs = np.abs(np.fft.fftfreq(len(x), 1.0 / rate))
+    power = np.abs(np.fft.fft(x))**2 / len(x)**2
+    return power[(freqs >= low) & (freqs < high)].sum()
+
+
+directory = tempfile.mkdtemp()
+filenames = [os.path.join(directory, '{}.edf'.format(name))
+             for name in ['a', 'b']]
+write_edf(filenames[0], [128, 25, 1], num_records=150, seed=0)
+write_edf(filenames[1], [64, 10], num_records=40, seed=1)
+
+bands = [('low', (0, 4)), ('mid', (4, 12)), ('high', (12, 65))]
+table = edffeatures.epoch_features(filenames[0], 1, bands=bands)
+
+with open(filenames[0], 'rb') as f:
+    header, signals = edf.header_and_signals(f)
+rates = edf.samples_per_sec(header)
+
+assert len(table) == 150 * len(signals)
+assert np.all(np.diff(table['epoch']) >= 0)
+
+for label, signal in signals.items():
+    rows = table[table['label'] == label]
+    epochs = signal.reshape(150, -1)
+    assert np.array_equal(rows['epoch'], np.arange(150))
+    assert np.allclose(rows['start'], np.arange(150))
+    assert np.allclose(rows['mean'], epochs.mean(axis=1))
+    assert np.allclose(rows['var'], epochs.var(axis=1))
+    assert np.allclose(rows['min'], epochs.min(axis=1))
+    assert np.allclose(rows['max'], epochs.max(axis=1))
+    assert np.allclose(rows['rms'], np.sqrt(np.mean(epochs**2, axis=1)))
+
+    for name, (low, high) in bands:
+        expected = [periodogram_power(x, rates[label], low, high)
+                    for x in epochs]
+        assert np.allclose(rows[name], expected)
+
+    total = sum(rows[name] for name, _ in bands)
+    diff = np.max(np.abs(total - np.mean(epochs**2, axis=1)))
+    print('{} ({} samples per epoch) Parseval max. difference {:.2e}'.format(
+        label, epochs.shape[1], diff))
+    assert np.allclose(total, np.mean(epochs**2, axis=1))
+
+subset = edffeatures.epoch_features(filenames[0], 5, ['rms'],
+                                    channels=['Signal 1'])
+assert subset.dtype.names == ('epoch', 'label', 'start', 'rms')
+assert np.all(subset['label'] == 'Signal 1')
+assert np.allclose(subset['start'], 5 * np.arange(30))
+
+many = os.path.join(directory, 'many.edf')
+labels = write_edf(many, [8] * 12, num_records=3, seed=2)
+ordered = edffeatures.epoch_features(many, 1, ['mean'])
+assert list(ordered['label']) == labels * 3
+
+tables = edffeatures.epoch_features_many(filenames, 2, processes=2,
+                                         bands=bands)
+assert list(tables) == filenames
+for filename, parallel in tables.items():
+    serial = edffeatures.epoch_features(filename, 2, bands=bands)
+    assert np.array_equal(parallel, serial)
+print('Features of {} files computed in parallel'.format(len(tables)))
+
+shutil.rmtree(directory)
@@ -0,0 +1,83 @@
+"""Test edfindex.py module."""
+
+import os
+import shutil
+import tempfile
+
+from importlib import reload
+
+import numpy as np
+
+import edf
+import edfindex
+reload(edfindex)
+
+from synthetic_edf import write_edf
+
+directory = tempfile.mkdtemp()
+edf_filename = os.path.join(directory, 'recording.edf')
+write_edf(edf_filename, [64, 20, 1], num_records=50)
+
+with open(edf_filename, 'rb') as f:
+    header, signals = edf.header_and_signals(f)
+rates = edf.samples_per_sec(header)
+
+bucket_size = 8
+index = edfindex.open_index(edf_filename, bucket_size)
+assert os.path.exists(edfindex.sidecar_filename(edf_filename))
+assert index.labels == header['label']
+
+for label, signal in signals.items():
+    for k in range(index.num_levels(label)):
+        scale = bucket_size * 2**k
+        mins, maxs, means = index.level(label, k)
+        buckets = [signal[i:i + scale] for i in range(0, len(signal), scale)]
+        assert np.allclose(mins, [b.min() for b in buckets])
+        assert np.allclose(maxs, [b.max() for b in buckets])
+        assert np.allclose(means, [b.mean() for b in buckets])
+
+    for start, stop, num_points in [(0, 50, 10), (3, 17, 5), (10, 11, 100)]:
+        times, mins, maxs, means = index.query(label, start, stop, num_points)
+        num_samples = (stop - start) * rates[label]
+        scale = bucket_size
+        while (scale * 2 <= bucket_size * 2**(index.num_levels(label) - 1)
+               and num_samples / (scale * 2) >= num_points):
+            scale *= 2
+        print('{} [{}, {}) {} points: {} buckets of {} samples'.format(
+            label, start, stop, num_points, len(times), scale))
+
+        lo = int(start * rates[label])
+        hi = int(stop * rates[label])
+        first = lo // scale * scale
+        buckets = [signal[i:i + scale] for i in range(first, hi, scale)]
+        assert len(times) == len(buckets)
+        assert np.allclose(times * rates[label], range(first, hi, scale))
+        assert np.allclose(mins, [b.min() for b in buckets])
+        assert np.allclose(maxs, [b.max() for b in buckets])
+        if num_samples >= num_points * bucket_size:
+            assert num_points <= len(times) <= 2 * num_points + 1
+
+label = index.labels[0]
+panned = index.query(label, -2, 2, 2)
+for a, b in zip(panned, index.query(label, 0, 2, 2)):
+    assert len(a) > 0 and np.array_equal(a, b)
+
+reloaded = edfindex.PyramidIndex.load(
+    edfindex.sidecar_filename(edf_filename))
+assert reloaded.is_current(edf_filename)
+for label in index.labels:
+    for k in range(index.num_levels(label)):
+        for a, b in zip(index.level(label, k), reloaded.level(label, k)):
+            assert np.allclose(a, b)
+
+stamp = os.stat(edf_filename).st_mtime_ns
+os.utime(edf_filename, ns=(stamp + 10**9, stamp + 10**9))
+assert not reloaded.is_current(edf_filename)
+assert edfindex.open_index(edf_filename, bucket_size).is_current(edf_filename)
+
+write_edf(edf_filename, [64, 20, 1], num_records=60)
+rebuilt = edfindex.open_index(edf_filename, bucket_size)
+assert rebuilt.is_current(edf_filename)
+assert len(rebuilt.level(header['label'][0], 0)[0]) == 60 * 64 // bucket_size
+
+shutil.rmtree(directory)
@@ -0,0 +1,30 @@
+"""Test that the numeric modules import without plotting libraries."""
+
+import os
+import subprocess
+import sys
+
+MODULES = ['bsplines', 'edf', 'edfcache', 'edffeatures', 'edfindex', 'lmm',
+           'optim', 'smoothing']
+
+HEAVY = ['matplotlib', 'pandas']
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = '''
+import sys
+from time import perf_counter
+start = perf_counter()
+import {module}
+elapsed = perf_counter() - start
+loaded = [m for m in {heavy!r} if m in sys.modules]
+print(elapsed, ' '.join(loaded))
+'''
+
+for module in MODULES:
+    script = SCRIPT.format(module=module, heavy=HEAVY)
+    output = subprocess.check_output([sys.executable, '-c', script],
+                                     cwd=DIRECTORY, universal_newlines=True)
+    elapsed, *loaded = output.split()
+    print('import {:<12} {:.3f}s'.format(module, float(elapsed)))
+    assert not loaded, '{} imports {}'.format(module, ', '.join(loaded))
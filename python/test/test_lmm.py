@@ -0,0 +1,258 @@
+"""Test lmm.py module."""
+
+import os
+import shutil
+import tempfile
+
+from importlib import reload
+from time import time
+
+import numpy as np
+import scipy.linalg as la
+
+import lmm
+reload(lmm)
+
+np.random.seed(0)
+
+p1, p2 = 4, 3
+model = lmm.LinearMixedModel(p1, p2)
+A = np.random.normal(size=(p2, p2))
+model.set_params(np.random.normal(size=p1), np.dot(A, A.T) + 0.1 * np.eye(p2),
+                 0.3)
+
+assert np.allclose(model._ranef_prec, la.inv(model._ranef_cov))
+for attempt in [lambda: setattr(model, '_ranef_cov', np.eye(p2)),
+                lambda: model._ranef_cov.__setitem__((0, 0), 5.0)]:
+    try:
+        attempt()
+    except (AttributeError, ValueError):
+        pass
+    else:
+        raise AssertionError('Changed a parameter without set_params.')
+assert np.allclose(model._ranef_prec, la.inv(model._ranef_cov))
+
+for n in [1, 2, 5, 50, 500]:
+    X = np.random.normal(size=(n, p1))
+    Z = np.random.normal(size=(n, p2))
+    y = np.random.normal(size=n)
+
+    logl = model.log_likelihood(y, X, Z)
+    dense = model._log_likelihood_dense(y, X, Z)
+    print('n={:3d} log likelihood {:.6f} (dense {:.6f})'.format(
+        n, logl, dense))
+    assert np.isclose(logl, dense)
+
+    m, S = model.posterior(y, X, Z)
+    P = la.inv(model._ranef_cov) + np.dot(Z.T, Z) / model._noise_var
+    resid = y - np.dot(X, model._coef)
+    assert np.allclose(S, la.inv(P))
+    assert np.allclose(m, la.solve(P, np.dot(Z.T, resid)) / model._noise_var)
+
+n = 2000
+X = np.random.normal(size=(n, p1))
+Z = np.random.normal(size=(n, p2))
+y = np.random.normal(size=n)
+
+start = time()
+model.log_likelihood(y, X, Z)
+print('Woodbury log likelihood of {} observations in {:.4f}s'.format(
+    n, time() - start))
+
+start = time()
+model._log_likelihood_dense(y, X, Z)
+print('Dense log likelihood of {} observations in {:.4f}s'.format(
+    n, time() - start))
+
+
+def simulate(num_subjects, max_obs):
+    dataset = []
+    for _ in range(num_subjects):
+        n = np.random.randint(1, max_obs + 1)
+        X = np.random.normal(size=(n, p1))
+        Z = X[:, :p2]
+        u = np.random.multivariate_normal(np.zeros(p2), model._ranef_cov)
+        y = np.dot(X, model._coef) + np.dot(Z, u)
+        y += np.random.normal(scale=np.sqrt(model._noise_var), size=n)
+        dataset.append((y, X, Z))
+    return dataset
+
+
+def reference_em_step(dataset, lmm):
+    posteriors = [lmm.posterior(*d) for d in dataset]
+    XtX = sum(np.dot(X.T, X) for _, X, _ in dataset)
+    Xty = sum(np.dot(X.T, y - np.dot(Z, m))
+              for (y, X, Z), (m, _) in zip(dataset, posteriors))
+    b = la.solve(XtX, Xty)
+    S = sum(S + np.outer(m, m) for m, S in posteriors) / len(dataset)
+    rss = sum(np.sum((y - np.dot(X, b) - np.dot(Z, m))**2) +
+              np.trace(np.dot(np.dot(Z.T, Z), S))
+              for (y, X, Z), (m, S) in zip(dataset, posteriors))
+    return b, S, rss / sum(len(y) for y, _, _ in dataset)
+
+
+dataset = simulate(200, 8)
+for expected, actual in zip(reference_em_step(dataset, model),
+                            lmm.em_step(dataset, model)):
+    assert np.allclose(expected, actual)
+
+stats = lmm.sufficient_stats(dataset)
+logl = sum(model.log_likelihood(*d) for d in dataset)
+assert np.isclose(lmm._e_step(stats, model).logl, logl)
+
+dataset = simulate(50000, 10)
+
+start = time()
+stats = lmm.sufficient_stats(dataset)
+print('Sufficient statistics of {} subjects in {:.2f}s'.format(
+    len(dataset), time() - start))
+
+start = time()
+fit = lmm.learn_lmm(dataset, maxiter=20, tol=0)
+print('20 EM iterations on {} subjects in {:.2f}s'.format(
+    len(dataset), time() - start))
+
+b, S, v = fit.param_copy()
+print('Estimated noise variance {:.3f} (true {:.3f})'.format(
+    v, model._noise_var))
+
+start = time()
+sharded = lmm.learn_lmm(dataset, maxiter=20, tol=0, processes=4)
+print('20 EM iterations on {} subjects in 4 processes in {:.2f}s'.format(
+    len(dataset), time() - start))
+
+for serial, parallel in zip(fit.param_copy(), sharded.param_copy()):
+    assert np.allclose(serial, parallel)
+
+with lmm._ShardedEStep(dataset[:1000], 2) as e_step:
+    broken = lmm.LinearMixedModel(p1, p2)
+    broken.set_params(b, S, -1e-3)
+    try:
+        e_step(broken)
+    except np.linalg.LinAlgError:
+        pass
+    else:
+        raise AssertionError('A failed E-step in a worker was not raised.')
+
+    expected = lmm._e_step(lmm.sufficient_stats(dataset[:1000]), fit)
+    assert np.isclose(e_step(fit).logl, expected.logl)
+
+dataset = simulate(2000, 5)
+stats = lmm.sufficient_stats(dataset)
+theta = lmm._pack(*model.param_copy())
+
+
+def logl_at(theta):
+    model.set_params(*lmm._unpack(theta, p1, p2))
+    return lmm._e_step(stats, model).logl
+
+
+numeric = np.array([(logl_at(theta + e) - logl_at(theta - e)) / 2e-6
+                    for e in 1e-6 * np.eye(len(theta))])
+model.set_params(*lmm._unpack(theta, p1, p2))
+analytic = lmm._gradient(model, stats, lmm._e_step(stats, model))
+assert np.allclose(numeric, analytic, rtol=1e-4, atol=1e-3)
+
+fits = {}
+for method in ['em', 'squarem', 'direct']:
+    start = time()
+    fits[method], info = lmm.learn_lmm(dataset, maxiter=5000, tol=1e-10,
+                                       method=method, full_output=True)
+    print('{:<8} {:5d} iterations {:5d} passes LL={:.6f} in {:.2f}s'.format(
+        method, info['iterations'], info['passes'], info['logl'],
+        time() - start))
+
+for method in ['squarem', 'direct']:
+    for expected, actual in zip(fits['em'].param_copy(),
+                                fits[method].param_copy()):
+        assert np.allclose(expected, actual, rtol=1e-3, atol=1e-3)
+
+store = tempfile.mkdtemp()
+lmm.write_stats(iter(dataset), store)
+stored = lmm.read_stats(store)
+for expected, actual in zip(stats, stored):
+    assert np.allclose(expected, actual)
+
+for attempt in [lambda: lmm.sufficient_stats([]),
+                lambda: lmm.write_stats(iter([]), tempfile.mkdtemp())]:
+    try:
+        attempt()
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('Computed statistics of an empty dataset.')
+
+
+def batches():
+    for i in range(0, len(dataset), 300):
+        yield dataset[i:i + 300]
+
+
+for source, processes in [(batches, 1), (stored, 1), (stored, 3)]:
+    streamed = lmm.learn_lmm(source, maxiter=5000, tol=1e-10,
+                             method='squarem', processes=processes)
+    for expected, actual in zip(fits['squarem'].param_copy(),
+                                streamed.param_copy()):
+        assert np.allclose(expected, actual)
+
+shutil.rmtree(store)
+
+model = fits['em']
+subjects = dataset[:1000]
+means, covs = model.posteriors(subjects)
+for (y, X, Z), m, S in zip(subjects, means, covs):
+    expected_m, expected_S = model.posterior(y, X, Z)
+    assert np.allclose(m, expected_m) and np.allclose(S, expected_S)
+
+y, X, Z = simulate(1, 1)[0]
+for y, X, Z in [dataset[0], (y, X, Z)]:
+    m, S = model.prior()
+    for k in range(0, len(y), 2):
+        m, S = model.update_posterior(m, S, y[k:k + 2], X[k:k + 2],
+                                      Z[k:k + 2])
+    expected_m, expected_S = model.posterior(y, X, Z)
+    assert np.allclose(m, expected_m) and np.allclose(S, expected_S)
+
+Xgrid = np.random.normal(size=(50, p1))
+Zgrid = Xgrid[:, :p2]
+mean, var = model.predict(means, covs, Xgrid, Zgrid)
+for m, S, mu, sigma2 in zip(means, covs, mean, var):
+    assert np.allclose(mu, np.dot(Xgrid, model._coef) + np.dot(Zgrid, m))
+    assert np.allclose(sigma2, np.diag(np.dot(np.dot(Zgrid, S), Zgrid.T)))
+
+mean, var = model.predict(means[0], covs[0], Xgrid, Zgrid, noise=True)
+assert mean.shape == var.shape == (50,)
+
+start = time()
+[model.posterior(*d) for d in dataset]
+print('Posteriors of {} subjects one at a time in {:.3f}s'.format(
+    len(dataset), time() - start))
+
+start = time()
+model.posteriors(dataset)
+print('Posteriors of {} subjects in one batch in {:.3f}s'.format(
+    len(dataset), time() - start))
+
+checkpoint = os.path.join(tempfile.mkdtemp(), 'fit.npz')
+straight, info = lmm.learn_lmm(dataset, maxiter=40, tol=0, full_output=True)
+print('Timers of 40 EM iterations:')
+for phase, timer in sorted(info['timers'].items()):
+    print('  {:<10} {wall:.3f}s wall {cpu:.3f}s CPU {calls} calls'.format(
+        phase, **timer))
+
+stop_at_15 = lambda record, model: record['iteration'] == 15
+_, info = lmm.learn_lmm(dataset, maxiter=40, tol=0, full_output=True,
+                        callback=stop_at_15, checkpoint=checkpoint)
+assert info['iterations'] == 15 and len(info['history']) == 15
+assert all(r['delta'] >= 0 for r in info['history'])
+
+resumed_model, state = lmm.load_checkpoint(checkpoint)
+assert state['iteration'] == 15
+
+resumed, info = lmm.learn_lmm(dataset, maxiter=40, tol=0, full_output=True,
+                              init=checkpoint)
+assert info['iterations'] == 40 and len(info['history']) == 25
+for expected, actual in zip(straight.param_copy(), resumed.param_copy()):
+    assert np.allclose(expected, actual)
+
+shutil.rmtree(os.path.dirname(checkpoint))
@@ -0,0 +1,272 @@
+"""Test smoothing.py module."""
+
+import tracemalloc
+import warnings
+
+from importlib import reload
+from time import time
+
+import numpy as np
+import scipy.linalg as la
+
+import smoothing
+reload(smoothing)
+
+
+def reference_smooth(x, y, xnew, kernel, bandwidth, degree):
+    """Smooth one input at a time by weighted least squares."""
+    ynew = np.zeros(len(xnew))
+    for i, x0 in enumerate(xnew):
+        X = np.array([(x - x0)**p for p in range(degree + 1)]).T
+        w = kernel((x - x0) / bandwidth) / bandwidth
+        ynew[i] = la.solve(X.T @ (w[:, None] * X), X.T @ (w * y))[0]
+    return ynew
+
+
+np.random.seed(0)
+
+n = 500
+x = np.sort(np.random.uniform(0, 10, n))
+y = np.sin(x) + np.random.normal(scale=0.3, size=n)
+xnew = np.linspace(0, 10, 101)
+
+for kernel in [smoothing.gaussian_kernel, smoothing.box_kernel]:
+    for degree in [0, 1, 2]:
+        expected = reference_smooth(x, y, xnew, kernel, 0.8, degree)
+        actual = smoothing.smooth(x, y, xnew, kernel, 0.8, degree)
+        diff = np.max(np.abs(actual - expected))
+        print('{} degree={} max. difference {:.2e}'.format(
+            kernel.__name__, degree, diff))
+        assert np.allclose(actual, expected)
+
+for kernel in [smoothing.box_kernel, smoothing.epanechnikov_kernel,
+               smoothing.tricube_kernel]:
+    for degree in [0, 1, 2]:
+        expected = reference_smooth(x, y, xnew, kernel, 0.8, degree)
+        actual = smoothing.KernelSmoother(x, y, kernel, 0.8, degree,
+                                          method='window')(xnew)
+        diff = np.max(np.abs(actual - expected))
+        print('{} degree={} window max. difference {:.2e}'.format(
+            kernel.__name__, degree, diff))
+        assert np.allclose(actual, expected)
+
+grid = np.arange(0, 10, 0.1)
+values = np.random.normal(size=len(grid))
+for bandwidth, degree in [(0.1, 0), (0.2, 1), (0.3, 0), (0.3, 2), (0.7, 1)]:
+    expected = reference_smooth(grid, values, grid, smoothing.box_kernel,
+                                bandwidth, degree)
+    actual = smoothing.smooth(grid, values, grid, smoothing.box_kernel,
+                              bandwidth, degree)
+    assert np.allclose(actual, expected)
+
+centres = np.sort(np.random.uniform(0, 1e9, 200))
+x = (centres[:, None] + np.random.uniform(-0.4, 0.4, (200, 5))).ravel()
+y = np.random.normal(size=len(x))
+
+tracemalloc.start()
+actual = smoothing.smooth(x, y, centres, smoothing.box_kernel, 1.0, 1)
+peak = tracemalloc.get_traced_memory()[1]
+tracemalloc.stop()
+
+expected = [reference_smooth(x[5 * i:5 * i + 5], y[5 * i:5 * i + 5], [c],
+                             smoothing.box_kernel, 1.0, 1)[0]
+            for i, c in enumerate(centres)]
+print('Sparse inputs spanning 1e9 bandwidths smoothed with peak memory '
+      '{:.1f} MB'.format(peak / 2**20))
+assert np.allclose(actual, expected)
+assert peak < 2**20
+
+n = 10000
+x = np.random.uniform(0, 10, n)
+y = np.sin(x) + np.random.normal(scale=0.3, size=n)
+xnew = np.linspace(0, 10, n)
+
+start = time()
+smoothing.smooth(x, y, xnew, smoothing.gaussian_kernel, 0.5, 1)
+print('Smoothed {0}x{0} in {1:.2f}s'.format(n, time() - start))
+
+n = 1000000
+x = np.random.uniform(0, 1000, n)
+y = np.sin(x) + np.random.normal(scale=0.3, size=n)
+
+start = time()
+smoothing.smooth(x, y, x, smoothing.epanechnikov_kernel, 0.05, 1)
+print('Smoothed {0}x{0} in {1:.2f}s'.format(n, time() - start))
+
+smoother = smoothing.KernelSmoother(x, y, smoothing.epanechnikov_kernel, 0.05)
+smoother([0.0])
+sums = smoother._window._ysums
+start = time()
+for x0 in np.linspace(0, 1000, 20):
+    smoother([x0])
+print('Evaluated 20 single inputs in {:.3f}s'.format(time() - start))
+assert smoother._window._ysums is sums
+
+n = 300
+x = np.sort(np.random.uniform(0, 10, n))
+y = np.sin(x) + np.random.normal(scale=0.3, size=n)
+
+for kernel in [smoothing.gaussian_kernel, smoothing.epanechnikov_kernel]:
+    for degree in [0, 1, 2]:
+        args = (x, y, kernel, 1.0, degree)
+        fast = smoothing.loo_estimates(*args)
+        slow = smoothing.loo_estimates(*args, method='refit')
+        diff = np.max(np.abs(fast - slow))
+        print('{} degree={} LOO max. difference {:.2e}'.format(
+            kernel.__name__, degree, diff))
+        assert np.allclose(fast, slow)
+
+Y = np.column_stack([y, np.cos(x)])
+args = (x, Y, smoothing.epanechnikov_kernel, 1.0, 1)
+fast = smoothing.loo_estimates(*args)
+assert np.allclose(fast, smoothing.loo_estimates(*args, method='refit'))
+for j in range(Y.shape[1]):
+    assert np.allclose(fast[:, j], smoothing.loo_estimates(
+        x, Y[:, j], smoothing.epanechnikov_kernel, 1.0, 1))
+assert np.allclose(smoothing.cv_scores(*args)[0], np.mean((Y - fast)**2))
+
+try:
+    smoothing.loo_estimates(x, y, smoothing.gaussian_kernel, 1.0, 1, 'hats')
+except ValueError:
+    pass
+else:
+    raise AssertionError('Accepted an unknown LOO method.')
+
+bandwidths = np.linspace(0.2, 2.0, 10)
+for criterion in ['loo', 'gcv']:
+    best = smoothing.estimate_bandwidth(x, y, smoothing.gaussian_kernel,
+                                        bandwidths, 1, criterion)
+    print('Best bandwidth by {} is {:.2f}'.format(criterion, best))
+
+search = smoothing.search_bandwidth(x, y, smoothing.gaussian_kernel,
+                                    np.geomspace(0.1, 3.0, 8), 1,
+                                    processes=2, refine=True)
+print('Refined bandwidth is {:.3f} after {} evaluations in {:.2f}s'.format(
+    search['bandwidth'], len(search['bandwidths']), search['elapsed']))
+assert search['score'] == np.min(search['loo'])
+
+n = 20000
+x = np.random.uniform(0, 100, n)
+y = np.sin(x / 3) + np.random.normal(scale=0.3, size=n)
+xnew = np.linspace(1, 99, 1000)
+
+for kernel in [smoothing.gaussian_kernel, smoothing.epanechnikov_kernel]:
+    for degree in [0, 1, 2, 3]:
+        exact = smoothing.smooth(x, y, xnew, kernel, 1.0, degree)
+        binned = smoothing.BinnedSmoother(x, y, kernel, 1.0, degree)(xnew)
+        diff = np.max(np.abs(binned - exact))
+        print('{} degree={} binned max. difference {:.2e}'.format(
+            kernel.__name__, degree, diff))
+        assert diff < 1e-2
+
+binned = smoothing.BinnedSmoother(x, y, smoothing.gaussian_kernel, 1.0, 1)
+outside = binned([x.min() - 1, x.max() + 1])
+assert np.all(np.isnan(outside))
+assert np.isfinite(binned([x.min(), x.max()])).all()
+
+x = np.r_[np.random.uniform(0, 10, 1000), np.random.uniform(40, 50, 1000)]
+y = np.sin(x) + np.random.normal(scale=0.3, size=len(x))
+xnew = np.linspace(0, 50, 501)
+gap = (xnew > 11.5) & (xnew < 38.5)
+data = ((xnew > 1) & (xnew < 9)) | ((xnew > 41) & (xnew < 49))
+
+for degree in [0, 1, 2]:
+    binned = smoothing.BinnedSmoother(x, y, smoothing.epanechnikov_kernel,
+                                      1.0, degree)(xnew)
+    exact = smoothing.smooth(x, y, xnew[data],
+                             smoothing.epanechnikov_kernel, 1.0, degree)
+    assert np.all(np.isnan(binned[gap]))
+    assert np.max(np.abs(binned[data] - exact)) < 1e-2
+
+x0 = np.full(50, 3.0)
+for degree in [0, 1]:
+    binned = smoothing.BinnedSmoother(x0, y[:50], smoothing.gaussian_kernel,
+                                      1.0, degree)
+    expected = [np.nan, y[:50].mean() if degree == 0 else np.nan, np.nan]
+    print('Binned degree={} on equal inputs gives {}'.format(
+        degree, binned([2.9, 3.0, 3.1])))
+    assert np.allclose(binned([2.9, 3.0, 3.1]), expected, equal_nan=True)
+
+with warnings.catch_warnings(record=True) as caught:
+    warnings.simplefilter('always')
+    smoothing.BinnedSmoother(x, y, smoothing.gaussian_kernel, 1.0, 1)
+    assert not caught
+    smoothing.BinnedSmoother([0.0, 5e3, 1e4], [0.0, 1.0, 0.0],
+                             smoothing.gaussian_kernel, 0.005, 1)
+print('Capped grid warns: {}'.format(caught[0].message))
+assert len(caught) == 1 and caught[0].category is RuntimeWarning
+
+n = 3000000
+x = np.random.uniform(0, 1000, n)
+y = np.sin(x) + np.random.normal(scale=0.3, size=n)
+
+start = time()
+smoothing.BinnedSmoother(x, y, smoothing.gaussian_kernel, 0.1, 1)(x)
+print('Binned smoothing of {} points in {:.2f}s'.format(n, time() - start))
+
+n, k = 2000, 100
+x = np.random.uniform(0, 10, n)
+Y = np.sin(x)[:, None] * np.random.uniform(size=k)
+Y += np.random.normal(size=(n, k))
+xnew = np.linspace(0, 10, n)
+
+for kernel in [smoothing.gaussian_kernel, smoothing.epanechnikov_kernel]:
+    start = time()
+    joint = smoothing.smooth(x, Y, xnew, kernel, 0.5, 1)
+    joint_time = time() - start
+
+    start = time()
+    separate = np.column_stack([smoothing.smooth(x, y, xnew, kernel, 0.5, 1)
+                                for y in Y.T])
+    separate_time = time() - start
+
+    print('{} {} series jointly in {:.2f}s, separately in {:.2f}s'.format(
+        kernel.__name__, k, joint_time, separate_time))
+    assert np.allclose(joint, separate)
+
+n, k = 20000, 300
+x = np.random.uniform(0, 10, n)
+Y = np.sin(x)[:, None] + np.random.normal(size=(n, k))
+xnew = np.linspace(0, 10, 500)
+
+tracemalloc.start()
+joint = smoothing.smooth(x, Y, xnew, smoothing.tricube_kernel, 0.5, 1)
+peak = tracemalloc.get_traced_memory()[1]
+tracemalloc.stop()
+
+print('{} tricube series of {} points with peak memory {:.0f} MB'.format(
+    k, n, peak / 2**20))
+assert peak < Y.nbytes + 16 * smoothing._DEFAULT_CHUNK_SIZE
+for j in [0, k - 1]:
+    assert np.allclose(joint[:, j], smoothing.smooth(
+        x, Y[:, j], xnew, smoothing.tricube_kernel, 0.5, 1))
+
+t = np.arange(0.0, 1000.0)
+y = np.sin(t / 20) + np.random.normal(scale=0.3, size=len(t))
+grid = np.linspace(700, 1000, 100)
+online = smoothing.OnlineKernelSmoother(grid, smoothing.gaussian_kernel, 10.0,
+                                        1, window=300)
+
+for i in range(0, len(t), 10):
+    online.append(t[i:i + 10], y[i:i + 10])
+
+recent = t >= t[-1] - 300
+batch = smoothing.smooth(t[recent], y[recent], grid,
+                         smoothing.gaussian_kernel, 10.0, 1)
+diff = np.max(np.abs(online() - batch))
+print('Online smoother max. difference {:.2e}'.format(diff))
+assert np.allclose(online(), batch)
+
+t = np.arange(0.0, 2000.0)
+y = np.sin(t / 20) + np.random.normal(scale=0.3, size=len(t))
+grid = np.linspace(0, 2000, 201)
+online = smoothing.OnlineKernelSmoother(grid, smoothing.epanechnikov_kernel,
+                                        10.0, 1, window=100)
+
+for i in range(0, len(t), 10):
+    online.append(t[i:i + 10], y[i:i + 10])
+
+streamed = online()
+online.refresh()
+assert np.all(np.isnan(streamed[grid < t[-1] - 110]))
+assert np.allclose(streamed, online(), equal_nan=True)